@@ -0,0 +1,69 @@
+"""
+  Asynchronous logging: the logger's handlers run on a background writer thread, fed through a
+  queue, so the run never waits on console or log file I/O. Records are flushed at exit.
+"""
+import atexit
+import logging
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+class QueueHandler(logging.Handler):
+    """
+    Enqueue each record, its message already merged with its args, for the QueueListener.
+    """
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            self.records.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+class QueueListener(threading.Thread):
+    """
+    Background writer: hand each queued record to the real handlers, until stop().
+    """
+    def __init__(self, records, handlers):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.records = records
+        self.handlers = handlers
+        self.stopped = False
+
+    def run(self):
+        record = self.records.get()
+        while record is not None:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            record = self.records.get()
+
+    def stop(self):
+        """
+        Write out every queued record, then close the handlers.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        self.records.put(None)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
+
+def start_async_logging(logger, handlers):
+    """
+    Attach handlers to logger through a queue and a started QueueListener, stopped at exit.
+    """
+    records = queue.Queue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
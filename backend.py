@@ -0,0 +1,384 @@
+"""
+  Database backends used by sync-pd-services.py.
+
+  ClpBackend shells out to the db2 command line processor, as the script always has.
+  DbapiBackend keeps one in-process DB-API connection (ibm_db_dbi against DB2, or sqlite3
+  against a local stand-in of the GMS4 tables) open for the whole run.
+"""
+import re
+from subprocess import Popen, PIPE
+
+from extract import read_extract
+from sqltemplate import split_sql_stmts
+
+BACKEND_CHOICES = ['clp', 'ibm_db', 'sqlite']
+STAGING_TABLE = 'SESSION.SYNC_PD_FIXES'
+STAGING_INDEX = 'SESSION.SYNC_PD_FIXES_IX'
+CLP_ERROR_RC = 4  # db2 CLP exit codes: 1 no rows (SQL0100W), 2 warning, 4 DB2 or SQL error, 8 system error.
+DB2_TIMESTAMP_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})-(\d{2})\.(\d{2})\.(\d{2})\.(\d{6})$')
+HADR_ROLE_RE = re.compile(r'\bRole\s*=')  # The snapshot's HADR Status 'Role = Standard|Primary|Standby'.
+SQLITE_BUSY_TIMEOUT = 60
+STAGING_ROWS_PER_INSERT = 1000
+FETCH_ROWS = 1000
+
+def convert_popen_strs_to_str(strs):
+    msg = ' '.join(strs.split('\\r'))
+    return msg.replace('\r', '').replace('\n', '')
+
+def create_staging_sql_stmt(fixed_players):
+    """
+    Declare the staging table and load the fixed players with multi-row inserts.
+    """
+    sql_stmts = [
+        'declare global temporary table ' + STAGING_TABLE + ' (',
+        '    contract_id bigint not null,',
+        '    email_verified smallint not null,',
+        '    service_status_id smallint not null',
+        ') on commit preserve rows not logged with replace;'
+    ]
+
+    for start in range(0, len(fixed_players), STAGING_ROWS_PER_INSERT):
+        values = []
+        for fixed_player in fixed_players[start:start + STAGING_ROWS_PER_INSERT]:
+            values.append('(%s, %s, %s)' % (fixed_player.contractId, fixed_player.emailVerified,
+                                            fixed_player.portalService))
+        sql_stmts.append('insert into ' + STAGING_TABLE + ' values')
+        sql_stmts.append(',\n'.join(values) + ';')
+
+    # The merge SQL looks every row up by contract_id:
+    sql_stmts.append('create index ' + STAGING_INDEX + ' on ' + STAGING_TABLE + ' (contract_id);')
+    return '\n'.join(sql_stmts) + '\n'
+
+def split_export_sql_stmt(sql_stmt):
+    """
+    Return (export filename, select statement) from an EXPORT TO ... OF DEL script.
+    """
+    lines = []
+    for line in sql_stmt.splitlines():
+        if not line.strip().startswith('--'):
+            lines.append(line)
+    sql_stmt = '\n'.join(lines).strip().rstrip(';')
+
+    match = re.search(r'export\s+to\s+(\S+)\s+of\s+del\s', sql_stmt, re.IGNORECASE)
+    if not match:
+        raise Exception('Not an EXPORT TO ... OF DEL statement')
+
+    return (match.group(1), sql_stmt[match.end():].strip())
+
+def format_del_row(row):
+    """
+    Format a result row the way DB2 EXPORT OF DEL does: character columns quoted, numbers bare.
+    """
+    fields = []
+    for value in row:
+        if value is None:
+            fields.append('')
+        elif isinstance(value, (int, float)) or type(value).__name__ in ('long', 'Decimal'):
+            fields.append(str(value))
+        else:
+            fields.append('"' + str(value).replace('"', '""') + '"')
+
+    return ','.join(fields)
+
+def translate_param_for_sqlite(param):
+    """
+    Translate a DB2 format timestamp parameter, such as the high-water mark, into SQLite's text
+    timestamp format, so it compares with the stored ones. Other parameters are unchanged.
+    """
+    match = isinstance(param, str) and DB2_TIMESTAMP_RE.match(param)
+    if not match:
+        return param
+    (day, hours, minutes, seconds, micros) = match.groups()
+    fraction = micros.rstrip('0') and '.' + micros.rstrip('0') or ''
+    return '%s %s:%s:%s%s' % (day, hours, minutes, seconds, fraction)
+
+def translate_sql_for_sqlite(sql_stmt):
+    """
+    Translate the DB2 dialect used by the export and merge SQL into SQLite.
+    """
+    def date_arith(match):
+        func = match.group(1).lower() == 'date' and 'date' or 'datetime'
+        amount = match.group(2).replace(' ', '') + match.group(3)
+        unit = match.group(4).lower().rstrip('s') + 's'
+        return "%s('now', '%s %s')" % (func, amount, unit)
+
+    sql_stmt = re.sub(r'(?i)\blistagg\s*\(', 'group_concat(', sql_stmt)
+    sql_stmt = re.sub(r'(?i)\s+within\s+group\s*\(\s*order\s+by\s+[\w.]+\s*\)', '', sql_stmt)
+    sql_stmt = re.sub(r'(?i)\bcurrent[ _](date|timestamp)\s*([+-])\s*(\d+)\s*(days?|hours?|minutes?|seconds?)\b',
+                      date_arith, sql_stmt)
+    sql_stmt = re.sub(r'(?i)\bmod\s*\(\s*([\w.]+)\s*,\s*(\d+)\s*\)', r'(\1 % \2)', sql_stmt)
+    sql_stmt = re.sub(r'(?i)\bcurrent date\b', "date('now')", sql_stmt)
+    sql_stmt = re.sub(r'(?i)\bcurrent timestamp\b', "datetime('now')", sql_stmt)
+    return sql_stmt
+
+class ClpBackend(object):
+    """
+    Run everything through the db2 CLP. The CLP back-end process keeps the connection
+    between db2 invocations made by this process.
+
+    An isolated backend, used by sync workers, runs each script from its own shell so it gets
+    its own CLP back-end process: connect, run, roll back on error, terminate.
+    """
+    name = 'clp'
+
+    def __init__(self, dbname, logger, logfile_name, historylog_name, isolated=False):
+        self.dbname = dbname
+        self.logger = logger
+        self.logfile_name = logfile_name
+        self.historylog_name = historylog_name
+        self.isolated = isolated
+
+    def clp_args(self, autocommit):
+        args = ['db2']
+        if not autocommit:
+            args.append('+c')
+        args.extend(['-z', self.logfile_name, '-l', self.historylog_name])
+
+        return self.session_args(args)
+
+    def command_args(self, command):
+        return self.session_args(['db2', command])
+
+    def session_args(self, args):
+        """
+        Wrap a db2 invocation in the isolated backend's own session: connect, run, roll back on error, terminate.
+        """
+        if not self.isolated:
+            return args
+
+        script = ('db2 "connect to $1" < /dev/null > /dev/null || exit 8; shift; "$@"; rc=$?; '
+                  '[ $rc -ge %d ] && db2 rollback < /dev/null > /dev/null; db2 terminate < /dev/null > /dev/null; '
+                  'exit $rc') % CLP_ERROR_RC
+        return ['sh', '-c', script, 'sh', self.dbname] + args
+
+    def run_clp(self, sql_stmt, autocommit=True):
+        process_session = Popen(self.clp_args(autocommit), stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                                universal_newlines=True)
+        stdoutStrings, stderrStrings = process_session.communicate(sql_stmt)
+        omsg = convert_popen_strs_to_str(stdoutStrings)
+        emsg = convert_popen_strs_to_str(stderrStrings)
+
+        if process_session.returncode >= CLP_ERROR_RC or omsg.count('error') or emsg.count('error'):
+            if not autocommit and not self.isolated:
+                self.rollback()
+            raise Exception(omsg or emsg)
+
+    def open_worker(self):
+        """
+        Return a backend with its own DB2 session, for use by one worker thread.
+        """
+        return ClpBackend(self.dbname, self.logger, self.logfile_name, self.historylog_name, isolated=True)
+
+    def connect(self):
+        connect_session = Popen(['db2', ('connect to ' + self.dbname)], stdout=PIPE, stderr=PIPE,
+                                universal_newlines=True)
+        if connect_session.wait():
+            stdoutStrings, stderrStrings = connect_session.communicate()
+            raise Exception(convert_popen_strs_to_str(stdoutStrings))
+
+        self.logger.verbose('Connected to ' + self.dbname)
+
+    def check_hadr(self):
+        """
+        Raise exception if HADR and role is Standby, or if the snapshot failed or has no role:
+        an unchecked role must not pass for a primary.
+        """
+        self.logger.verbose('Checking HADR ...')
+        hadr_enabled = False
+        role_standby = False
+        process_session = Popen(self.command_args('get snapshot for database on ' + self.dbname), stdout=PIPE,
+                                stderr=PIPE, universal_newlines=True)
+        stdoutStrings, stderrStrings = process_session.communicate()
+        if process_session.returncode >= CLP_ERROR_RC:
+            msg = 'HADR check failed, rc ' + str(process_session.returncode)
+            output = convert_popen_strs_to_str(stdoutStrings or stderrStrings)
+            raise Exception(output and msg + ': ' + output or msg)
+        if not HADR_ROLE_RE.search(stdoutStrings):
+            msg = 'HADR check failed, no role in the database snapshot'
+            raise Exception(msg)
+
+        for line in stdoutStrings.split('\\r'):
+            if line.count('HADR'): hadr_enabled = True
+            if re.search('Role .*= Standby', line): role_standby = True
+            if line.count('SQL1013N'):
+                msg = convert_popen_strs_to_str(line)
+                raise Exception(msg)
+
+        if hadr_enabled and role_standby:
+            msg = 'HADR Role: Standby'
+            raise Exception(msg)
+
+    def export(self, sql_stmt, params=(), spool=False):
+        """
+        Run the EXPORT, then return an iterator over the lines of its DEL file.
+        The CLP can't bind parameters; each ? is replaced by its value as a string literal.
+        The DEL file is always complete before it is read, so spool changes nothing here.
+        """
+        (export_filename, select_stmt) = split_export_sql_stmt(sql_stmt)
+        for param in params:
+            sql_stmt = sql_stmt.replace('?', "'" + str(param).replace("'", "''") + "'", 1)
+        self.run_clp(sql_stmt)
+        return read_extract(export_filename)
+
+    def sync_batch(self, fixed_players, template):
+        self.run_clp(template.render_batch(fixed_players), autocommit=False)
+
+    def merge(self, fixed_players, merge_sql):
+        self.run_clp(create_staging_sql_stmt(fixed_players) + merge_sql, autocommit=False)
+
+    def rollback(self):
+        Popen(['db2', 'rollback'], stdout=PIPE, stderr=PIPE).communicate()
+
+    def close(self):
+        if not self.isolated:
+            Popen(['db2', 'terminate'], stdout=PIPE, stderr=PIPE).communicate()
+
+class DbapiBackend(object):
+    """
+    One DB-API connection for the whole run, prepared qmark statements and executemany.
+    """
+    def __init__(self, name, dbapi, dbname, logger):
+        self.name = name
+        self.dbapi = dbapi
+        self.dbname = dbname
+        self.logger = logger
+        self.connection = None
+
+    def connect(self):
+        if self.name == 'sqlite':
+            # The stand-in database file holds the GMS4 tables; SESSION holds the staging table.
+            self.connection = self.dbapi.connect(':memory:', timeout=SQLITE_BUSY_TIMEOUT)
+            self.connection.execute("attach database ? as GMS4", (self.dbname,))
+            self.connection.execute("attach database ':memory:' as SESSION")
+        else:
+            self.connection = self.dbapi.connect(self.dbname, '', '')
+
+        self.logger.verbose('Connected to ' + self.dbname + ' (' + self.name + ')')
+
+    def open_worker(self):
+        """
+        Return a new connected backend, for use by one worker thread.
+        """
+        worker = DbapiBackend(self.name, self.dbapi, self.dbname, self.logger)
+        worker.connect()
+        return worker
+
+    def translate(self, sql_stmt):
+        if self.name == 'sqlite':
+            return translate_sql_for_sqlite(sql_stmt)
+        return sql_stmt
+
+    def translate_params(self, params):
+        if self.name == 'sqlite':
+            return tuple([translate_param_for_sqlite(param) for param in params])
+        return tuple(params)
+
+    def check_hadr(self):
+        """
+        Raise exception if HADR and role is Standby.
+        """
+        if self.name == 'sqlite':
+            return
+
+        self.logger.verbose('Checking HADR ...')
+        cursor = self.connection.cursor()
+        cursor.execute('select hadr_role from table(mon_get_hadr(null))')
+        for row in cursor.fetchall():
+            if str(row[0]).strip().upper() == 'STANDBY':
+                raise Exception('HADR Role: Standby')
+        cursor.close()
+
+    def export(self, sql_stmt, params=(), spool=False):
+        """
+        Run the select part of the EXPORT statement, binding params, and return an iterator that
+        streams DEL lines straight from the cursor, writing the DEL file as it goes.
+        If spool, write the whole DEL file and close the cursor first, then iterate over the file:
+        an open export cursor holds read locks that block other sessions' commits (SQLite's
+        database lock), so sync workers must not start while it streams.
+        """
+        (export_filename, select_stmt) = split_export_sql_stmt(sql_stmt)
+        cursor = self.connection.cursor()
+        cursor.execute(self.translate(select_stmt), self.translate_params(params))
+        csv_lines = self.stream_del_lines(cursor, export_filename)
+        if not spool:
+            return csv_lines
+
+        for csv_line in csv_lines:
+            pass
+        return read_extract(export_filename)
+
+    def stream_del_lines(self, cursor, export_filename):
+        fout = open(export_filename, 'w')
+        rows = cursor.fetchmany(FETCH_ROWS)
+        while rows:
+            for row in rows:
+                csv_line = format_del_row(row) + '\n'
+                fout.write(csv_line)
+                yield csv_line
+            rows = cursor.fetchmany(FETCH_ROWS)
+        fout.close()
+        cursor.close()
+
+    def run_in_transaction(self, func):
+        cursor = self.connection.cursor()
+        try:
+            func(cursor)
+            self.connection.commit()
+        except Exception as error:
+            self.connection.rollback()
+            raise Exception(str(error))
+        cursor.close()
+
+    def sync_batch(self, fixed_players, template):
+        def apply_batch(cursor):
+            for (sql_stmt, attrs) in template.parameterized:
+                cursor.executemany(self.translate(sql_stmt), template.params(attrs, fixed_players))
+
+        self.run_in_transaction(apply_batch)
+
+    def merge(self, fixed_players, merge_sql):
+        def apply_merge(cursor):
+            if self.name == 'sqlite':
+                cursor.execute('drop table if exists ' + STAGING_TABLE)
+                cursor.execute('create table ' + STAGING_TABLE +
+                               ' (contract_id integer not null, email_verified integer not null,'
+                               ' service_status_id integer not null)')
+            else:
+                cursor.execute(split_sql_stmts(create_staging_sql_stmt([]))[0])
+
+            params = [(int(p.contractId), int(p.emailVerified), int(p.portalService)) for p in fixed_players]
+            cursor.executemany('insert into ' + STAGING_TABLE + ' values (?, ?, ?)', params)
+            if self.name == 'sqlite':
+                cursor.execute('create index ' + STAGING_INDEX + ' on ' + STAGING_TABLE.split('.')[1] + ' (contract_id)')
+            else:
+                cursor.execute(split_sql_stmts(create_staging_sql_stmt([]))[-1])
+
+            for sql_stmt in split_sql_stmts(merge_sql):
+                cursor.execute(self.translate(sql_stmt))
+
+        self.run_in_transaction(apply_merge)
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+def create_backend(options, logger, logfile_name, historylog_name):
+    if options.backend == 'clp':
+        return ClpBackend(options.dbname, logger, logfile_name, historylog_name)
+
+    if options.backend == 'sqlite':
+        import sqlite3
+        return DbapiBackend('sqlite', sqlite3, options.dbname, logger)
+
+    if options.backend == 'ibm_db':
+        try:
+            import ibm_db_dbi
+        except ImportError:
+            raise Exception('ibm_db_dbi is not installed, use --backend clp')
+        return DbapiBackend('ibm_db', ibm_db_dbi, options.dbname, logger)
+
+    raise Exception('Unknown backend: ' + options.backend)
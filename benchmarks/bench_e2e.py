@@ -0,0 +1,183 @@
+#! /usr/bin/python
+
+"""
+  End-to-end benchmark of sync-pd-services.py on synthetic data, no PDDB needed.
+
+  nodb        : --nodb over the synthetic extract
+  find        : --find through fake_db2.py, which serves the extract as the EXPORT
+  sync        : --sync through fake_db2.py, which records every statement
+  sqlite-sync : --sync --backend sqlite against a fresh synthetic replica database
+
+  Each mode runs --repeat times on the same seeded data; the median wall time is reported, with
+  the run's phase times from its metrics file. Results are appended as one JSON line per mode to
+  --output, tagged with the git commit, so runs can be compared across commits.
+
+  Usage: python benchmarks/bench_e2e.py [--rows N] [--modes nodb,find,sync] [--output FILE]
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+SCRIPT_FILENAME = os.path.join(BASE_DIR, 'sync-pd-services.py')
+SQL_FILENAMES = ['export-sync-pd-services.sql', 'export-fixes-sync-pd-services.sqlt', 'sync-pd-player-services.sqlt',
+                 'merge-sync-pd-services.sql']
+MODES = ['nodb', 'find', 'sync', 'sqlite-sync']
+DEFAULT_MODES = 'nodb,find,sync,sqlite-sync'
+DEFAULT_REPEAT = 3
+EXTRACT_FILENAME = 'bench-sync-pd-services.csv'
+
+def git_commit():
+    try:
+        process = subprocess.Popen(['git', 'describe', '--always', '--dirty'], cwd=BASE_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        (stdout, stderr) = process.communicate()
+        return process.returncode == 0 and stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+def install_fake_db2(bin_dir):
+    """
+    Put a db2 wrapper running fake_db2.py with this interpreter first on the PATH.
+    """
+    db2_filename = os.path.join(bin_dir, 'db2')
+    fout = open(db2_filename, 'w')
+    fout.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.join(BENCH_DIR, 'fake_db2.py')))
+    fout.close()
+    os.chmod(db2_filename, 493)  # 0755
+
+def script_args(mode, work_dir, db_filename):
+    args = [sys.executable, SCRIPT_FILENAME, '--path', work_dir, '--log_dir', os.path.join(work_dir, 'logs')]
+    if mode == 'nodb':
+        return args + ['--nodb', '--csvfile', EXTRACT_FILENAME]
+    if mode == 'find':
+        return args + ['--find']
+    if mode == 'sync':
+        return args + ['--sync']
+    return args + ['--sync', '--backend', 'sqlite', '--dbname', db_filename]
+
+def run_mode(options, mode, work_dir, players):
+    """
+    Return (wall seconds of each run, metrics summary of the last run).
+    """
+    db_filename = os.path.join(work_dir, 'bench-pddb.sqlite')
+    env = dict(os.environ)
+    env['PATH'] = os.path.join(work_dir, 'bin') + os.pathsep + env.get('PATH', '')
+    env['FAKE_DB2_EXTRACT'] = os.path.join(work_dir, EXTRACT_FILENAME)
+    env['FAKE_DB2_LOG'] = os.path.join(work_dir, 'logs', mode + '-db2.log')
+
+    seconds = []
+    for run in range(options.repeat):
+        if mode == 'sqlite-sync':
+            synthetic.write_replica_db(db_filename, players())
+        for filename in ('sync-pd-services.csv', env['FAKE_DB2_LOG']):
+            if os.path.exists(os.path.join(work_dir, filename)):
+                os.remove(os.path.join(work_dir, filename))
+
+        console = open(os.path.join(work_dir, 'logs', mode + '.console'), 'w')
+        start = time.time()
+        returncode = subprocess.call(script_args(mode, work_dir, db_filename) + options.script_args.split(),
+                                     cwd=work_dir, env=env, stdin=open(os.devnull), stdout=console, stderr=console)
+        seconds.append(time.time() - start)
+        console.close()
+        if returncode:
+            raise Exception(mode + ' failed, rc ' + str(returncode) + ', see ' + console.name)
+
+    fin = open(os.path.join(work_dir, 'logs', metrics_filename(mode)))
+    summary = json.load(fin)
+    fin.close()
+    return (seconds, summary)
+
+def metrics_filename(mode):
+    """
+    The metrics file of a mode's runs: sync-pd-services.metrics.json for a --sync, else named after the mode.
+    """
+    script_mode = mode.split('-')[-1]
+    if script_mode == 'sync':
+        return 'sync-pd-services.metrics.json'
+    return 'sync-pd-services.' + script_mode + '.metrics.json'
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', action='store', type='int', dest='rows', default=synthetic.DEFAULT_ROWS)
+    parser.add_option('--out_of_sync', action='store', type='float', dest='out_of_sync',
+                      default=synthetic.DEFAULT_OUT_OF_SYNC)
+    parser.add_option('--internal', action='store', type='float', dest='internal', default=synthetic.DEFAULT_INTERNAL)
+    parser.add_option('--seed', action='store', type='int', dest='seed', default=synthetic.DEFAULT_SEED)
+    parser.add_option('--repeat', action='store', type='int', dest='repeat', default=DEFAULT_REPEAT)
+    parser.add_option('--modes', action='store', type='str', dest='modes', default=DEFAULT_MODES,
+                      help=','.join(MODES) + ' (default=' + DEFAULT_MODES + ')')
+    parser.add_option('--script_args', action='store', type='str', dest='script_args', default='',
+                      help='More sync-pd-services.py arguments, e.g. "--progress --batch_size 500"')
+    parser.add_option('--output', action='store', type='str', dest='output', default=None, metavar='FILE',
+                      help='Append the results, one JSON line per mode, to FILE')
+    parser.add_option('--keep', action='store_true', dest='keep', default=False,
+                      help='Keep the work directory, with the logs and the fake db2 statement log')
+    options, args = parser.parse_args()
+
+    modes = options.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('Unknown mode: ' + mode)
+
+    def players():
+        return synthetic.generate_players(options.rows, options.out_of_sync, options.internal, options.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='bench-sync-pd-services-')
+    os.mkdir(os.path.join(work_dir, 'bin'))
+    os.mkdir(os.path.join(work_dir, 'logs'))
+    install_fake_db2(os.path.join(work_dir, 'bin'))
+    for filename in SQL_FILENAMES:
+        shutil.copy(os.path.join(BASE_DIR, filename), work_dir)
+    synthetic.write_extract(os.path.join(work_dir, EXTRACT_FILENAME), players())
+
+    commit = git_commit()
+    print('commit %s, python %s, %d rows, %.3f out of sync, seed %d' % (
+        commit, platform.python_version(), options.rows, options.out_of_sync, options.seed))
+
+    try:
+        for mode in modes:
+            (seconds, summary) = run_mode(options, mode, work_dir, players)
+            median = sorted(seconds)[len(seconds) // 2]
+            phases = ', '.join(['%s %.2f' % (phase['phase'], phase['seconds']) for phase in summary['phases']])
+            print('%-12s %8.2f s median %10.0f rows/s   %s' % (mode, median, options.rows / median, phases))
+
+            if options.output:
+                result = {
+                    'commit': commit,
+                    'python': platform.python_version(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'mode': mode,
+                    'rows': options.rows,
+                    'out_of_sync': options.out_of_sync,
+                    'internal': options.internal,
+                    'seed': options.seed,
+                    'script_args': options.script_args,
+                    'seconds': seconds,
+                    'median_seconds': median,
+                    'rows_per_second': options.rows / median,
+                    'phases': summary['phases'],
+                    'counters': summary['counters']
+                }
+                fout = open(options.output, 'a')
+                fout.write(json.dumps(result, sort_keys=True) + '\n')
+                fout.close()
+    finally:
+        if options.keep:
+            print('Work directory: ' + work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/python
+
+"""
+  Benchmark the export DEL extract parsers on a synthetic sync-pd-services.csv.
+
+  legacy : the original Player.__init__ strip/replace/split parser
+  csv    : extract.iter_rows over file lines
+  batch  : extract.iter_batches into PlayerBatch objects
+
+  Usage: python benchmarks/bench_extract.py [--rows N] [--file FILE]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from extract import iter_batches, iter_rows, read_extract
+
+DEFAULT_ROWS = 2000000
+
+def legacy_parse(csv_line):
+    tokens = csv_line.strip().replace('"', '').split(',')
+    return (
+        tokens[0],
+        tokens[1],
+        str(int(tokens[2].replace('+', '').replace('.', ''))),
+        str(int(tokens[3].replace('+', '').replace('.', ''))),
+        tokens[6].strip(),
+        tokens[7].strip()
+    )
+
+def write_synthetic_extract(filename, rows, seed=1):
+    rand = random.Random(seed)
+    fout = open(filename, 'w')
+    for i in range(rows):
+        contract_id = 1000000 + i
+        fout.write('"%010d","player-%d@example.com",+%010d.,+%d.,"1, 500","%d, %d"\n' % (
+            contract_id, i, contract_id, rand.randint(0, 1), rand.randint(1, 3), rand.randint(1, 3)))
+    fout.close()
+
+def time_it(name, rows, func):
+    start = time.time()
+    count = func()
+    elapsed = time.time() - start
+    print('%-8s %10d rows %8.2f s %12.0f rows/s' % (name, count, elapsed, count / max(elapsed, 1e-9)))
+    assert count == rows, '%s parsed %d of %d rows' % (name, count, rows)
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', action='store', type='int', dest='rows', default=DEFAULT_ROWS)
+    parser.add_option('--file', action='store', type='str', dest='file', default=None,
+                      help='Existing or to-be-generated extract file (default: a temporary file)')
+    options, args = parser.parse_args()
+
+    filename = options.file or os.path.join(tempfile.gettempdir(), 'bench-sync-pd-services.csv')
+    if not os.path.exists(filename):
+        write_synthetic_extract(filename, options.rows)
+    rows = sum(1 for line in open(filename))
+
+    time_it('legacy', rows, lambda: sum(1 for line in read_extract(filename) if legacy_parse(line)))
+    time_it('csv', rows, lambda: sum(1 for row in iter_rows(read_extract(filename))))
+    time_it('batch', rows, lambda: sum(len(batch) for batch in iter_batches(read_extract(filename))))
+
+    if not options.file:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#! /usr/bin/python
+
+"""
+  Benchmark the cost, seen by the caller, of reporting every player.
+
+  sync     : a logger.info line per player, console and file handlers called synchronously
+  async    : the same lines through asynclog, handlers on the background writer thread
+  progress : progress.Progress lines plus the buffered progress.AuditFile
+
+  The console handler writes to a temporary file, like a redirected cron run.
+  Usage: python benchmarks/bench_logging.py [--rows N]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from asynclog import start_async_logging
+from player import Player
+from progress import AuditFile, Progress
+
+DEFAULT_ROWS = 200000
+FORMAT_BASE = '%(levelname)s - %(module)s - %(message)s'
+
+def create_logger(name, dirname):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    console_handler = logging.StreamHandler(open(os.path.join(dirname, name + '.console'), 'w'))
+    console_handler.setFormatter(logging.Formatter(fmt=FORMAT_BASE))
+    file_handler = logging.FileHandler(os.path.join(dirname, name + '.log'))
+    file_handler.setFormatter(logging.Formatter(fmt='%(asctime)s - ' + FORMAT_BASE))
+    return (logger, [console_handler, file_handler])
+
+def report_players(logger, players):
+    for (processed_count, player) in enumerate(players):
+        logger.info('%03s %s %s' % (str(processed_count + 1), 'sync', player))
+
+def time_it(name, rows, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print('%-9s %8d rows %8.3f s %8.2f us/row' % (name, rows, elapsed, elapsed * 1e6 / rows))
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', action='store', type='int', dest='rows', default=DEFAULT_ROWS)
+    options, args = parser.parse_args()
+
+    players = [Player.from_fields('%010d' % i, 'player-%d@example.com' % i, str(1000000 + i), '1', '3', '3', 1)
+               for i in range(options.rows)]
+    dirname = tempfile.mkdtemp()
+
+    (sync_logger, handlers) = create_logger('sync', dirname)
+    for handler in handlers:
+        sync_logger.addHandler(handler)
+    time_it('sync', options.rows, lambda: report_players(sync_logger, players))
+
+    (async_logger, handlers) = create_logger('async', dirname)
+    listener = start_async_logging(async_logger, handlers)
+    time_it('async', options.rows, lambda: report_players(async_logger, players))
+    time_it('+drain', options.rows, listener.stop)
+
+    (progress_logger, handlers) = create_logger('progress', dirname)
+    for handler in handlers:
+        progress_logger.addHandler(handler)
+
+    def report_progress():
+        progress = Progress(progress_logger)
+        audit = AuditFile(os.path.join(dirname, 'progress.audit'))
+        for (processed_count, player) in enumerate(players):
+            audit.write(processed_count + 1, 'sync', player)
+            progress.update('sync')
+        progress.finish()
+        audit.close()
+
+    time_it('progress', options.rows, report_progress)
+
+    for filename in os.listdir(dirname):
+        os.remove(os.path.join(dirname, filename))
+    os.rmdir(dirname)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+"""
+  Micro-benchmark: cost per row of rendering sync-pd-player-services.sqlt.
+
+  legacy   : read the SQLT per player (s += line loop) and chain three str.replace calls
+  compiled : SqlTemplate.render, loaded and compiled once
+  batch    : SqlTemplate.render_batch, one string per batch of --batch_size players
+
+  Usage: python benchmarks/bench_render.py [--rows N] [--batch_size N]
+"""
+import os
+import sys
+import time
+from optparse import OptionParser
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BASE_DIR)
+
+from player import Player
+from sqltemplate import load_sql_template
+
+SQLT_FILENAME = os.path.join(BASE_DIR, 'sync-pd-player-services.sqlt')
+DEFAULT_ROWS = 100000
+DEFAULT_BATCH_SIZE = 100
+
+def legacy_read_file(filename):
+    fin = open(filename, 'r')
+
+    s = ''
+    for line in fin.readlines():
+        s += line
+
+    fin.close()
+
+    return s
+
+def legacy_create_sql_stmt(filename, player):
+    sqlt = legacy_read_file(filename)
+    sql_stmt = sqlt.replace('ContractId', player.contractId).replace('EmailVerifiedStatus', player.emailVerified).replace(
+        'PP_ServiceStatusId', player.portalService)
+    return sql_stmt
+
+def time_it(name, rows, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print('%-9s %8d rows %8.3f s %8.2f us/row' % (name, rows, elapsed, elapsed * 1e6 / rows))
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', action='store', type='int', dest='rows', default=DEFAULT_ROWS)
+    parser.add_option('--batch_size', action='store', type='int', dest='batch_size', default=DEFAULT_BATCH_SIZE)
+    options, args = parser.parse_args()
+
+    players = [Player.from_fields('%010d' % i, 'player-%d@example.com' % i, str(1000000 + i), '1', '3', '3')
+               for i in range(options.rows)]
+    template = load_sql_template(SQLT_FILENAME)
+    assert legacy_create_sql_stmt(SQLT_FILENAME, players[0]) == template.render(players[0])
+
+    def render_batches():
+        for start in range(0, len(players), options.batch_size):
+            template.render_batch(players[start:start + options.batch_size])
+
+    time_it('legacy', options.rows, lambda: [legacy_create_sql_stmt(SQLT_FILENAME, player) for player in players])
+    time_it('compiled', options.rows, lambda: [template.render(player) for player in players])
+    time_it('batch', options.rows, render_batches)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#! /usr/bin/python
+
+"""
+  Fake db2 CLP for benchmarks and tests without a PDDB, called the way backend.ClpBackend calls
+  db2: a command argument ('connect to PDDB', 'terminate', ...) or a script on stdin.
+
+  Every invocation and script is appended to $FAKE_DB2_LOG. An EXPORT TO file OF DEL copies
+  $FAKE_DB2_EXTRACT to file. A script containing $FAKE_DB2_FAIL, a contract_id, fails with rc 4.
+  A database snapshot reports the HADR role $FAKE_DB2_HADR_ROLE (default=Standard).
+"""
+import os
+import re
+import shutil
+import sys
+
+CLP_OPTIONS_WITH_VALUE = ('-z', '-l', '-f', '-r')
+
+def parse_args(args):
+    """
+    Return the command, or None when the script is read from stdin.
+    """
+    command = []
+    index = 0
+    while index < len(args):
+        if args[index] in CLP_OPTIONS_WITH_VALUE:
+            index += 2
+            continue
+        if args[index][:1] not in ('-', '+'):
+            command.append(args[index])
+        index += 1
+    return command and ' '.join(command) or None
+
+def main():
+    command = parse_args(sys.argv[1:])
+    script = command is None and sys.stdin.read() or ''
+
+    log_filename = os.environ.get('FAKE_DB2_LOG')
+    if log_filename:
+        flog = open(log_filename, 'a')
+        flog.write('-- db2 %s\n%s\n' % (' '.join(sys.argv[1:]), script))
+        flog.close()
+
+    if command and command.startswith('get snapshot for database'):
+        sys.stdout.write('HADR Status\n  Role                   = %s\n' % os.environ.get('FAKE_DB2_HADR_ROLE', 'Standard'))
+        return
+
+    match = re.search(r'export\s+to\s+(\S+)\s+of\s+del\s', script, re.IGNORECASE)
+    if match:
+        shutil.copy(os.environ['FAKE_DB2_EXTRACT'], match.group(1))
+
+    fail = os.environ.get('FAKE_DB2_FAIL')
+    if fail and re.search(r'\b' + fail + r'\b', script):
+        sys.stdout.write('SQL0911N  The current transaction has been rolled back. fake error\n')
+        sys.exit(4)
+
+    sys.stdout.write('DB20000I  The SQL command completed successfully.\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#! /usr/bin/python
+
+"""
+  Scenario replay harness: load-test and regression-test the sync against a local SQLite replica.
+
+  A replica of the GMS4.sms_* tables gets --accounts in-sync accounts per scenario, plus
+  --background in-sync accounts updated in the export window. Each persist-scenarios/scenario-N.sql
+  is then replayed against its scenario's accounts, its email predicate rewritten to match them all.
+  sync-pd-services.py --sync --backend sqlite runs the export and sync, and every account's final
+  state is checked: a scenario with a target, updated in the export window, must end in the target
+  state (scenarios.TARGET_STATES), every other account must be left as replayed.
+
+  Exits 1 on any mismatch.
+  Usage: python benchmarks/replay_scenarios.py [--accounts N] [--separate] [--script_args "..."]
+"""
+import glob
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import scenarios
+from backend import translate_sql_for_sqlite
+from sqltemplate import read_file, split_sql_stmts
+from synthetic import REPLICA_SCHEMA
+
+SCRIPT_FILENAME = os.path.join(BASE_DIR, 'sync-pd-services.py')
+SCENARIOS_DIR = os.path.join(BASE_DIR, 'persist-scenarios')
+SQL_FILENAMES = ['export-sync-pd-services.sql', 'export-fixes-sync-pd-services.sqlt', 'sync-pd-player-services.sqlt',
+                 'merge-sync-pd-services.sql']
+DEFAULT_ACCOUNTS = 1000
+DEFAULT_BACKGROUND = 0
+DEFAULT_DAYS_BACK = -1
+
+# The scenario scripts pick their accounts by email: = 'x', in ( 'x' ), like 'x%', and one "in like".
+EMAIL_PREDICATE_RE = re.compile(r"cc\.value\s+(?:=|in\s+like|like|in)\s*\(?\s*'[^']*'\s*\)?", re.IGNORECASE)
+# Some pick one contract with a scalar subquery, contract_id = (select ...).
+SCALAR_SUBQUERY_RE = re.compile(r'contract_id\s*=\s*\(\s*select', re.IGNORECASE)
+SCENARIO_FILENAME_RE = re.compile(r'scenario-(\d+)\.sql$')
+
+# Accounts start preactive, both services alike, updated long before any export window.
+INITIAL_STATE = scenarios.TARGET_STATES[scenarios.PREACTIVATE]
+
+def scenario_email(scenario, index):
+    return 'replay-%02d-%07d@mailinator.com' % (scenario, index)
+
+def scenario_contract_id(scenario, index):
+    return 10000000 * scenario + index
+
+def connect_replica(filename):
+    """
+    Connect the way backend.DbapiBackend does, with the replica attached as GMS4.
+    """
+    connection = sqlite3.connect(':memory:')
+    connection.execute('attach database ? as GMS4', (filename,))
+    return connection
+
+def create_replica(filename, scenario_numbers, accounts, background):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    connection = sqlite3.connect(filename)
+    connection.executescript(REPLICA_SCHEMA)
+    (email_verified, pp_status, sc_status) = INITIAL_STATE
+
+    players = []
+    for scenario in scenario_numbers:
+        for index in range(accounts):
+            players.append((scenario_contract_id(scenario, index), scenario_email(scenario, index), "'-30 days'"))
+    for index in range(background):
+        players.append((scenario_contract_id(0, index), 'replay-bg-%07d@example.com' % index, "'-6 hours'"))
+
+    for (offset, last_updated) in (("'-30 days'", '-30 days'), ("'-6 hours'", '-6 hours')):
+        rows = [(contract_id, email) for (contract_id, email, player_offset) in players if player_offset == offset]
+        connection.executemany('insert into sms_contracts values (?, ?, 1)',
+                               [(contract_id, '%010d' % contract_id) for (contract_id, email) in rows])
+        connection.executemany("insert into sms_customer_contacts values (?, 1, ?, %d, datetime('now', '%s'))" % (
+            email_verified, last_updated), rows)
+        connection.executemany("insert into sms_customer_services values (?, ?, ?, datetime('now', '%s'))" % (
+            last_updated), [(contract_id, service_type_id, status) for (contract_id, email) in rows
+                            for (service_type_id, status) in ((1, pp_status), (500, sc_status))])
+    connection.commit()
+    connection.close()
+
+def replay_scenario(connection, scenario, sql):
+    """
+    Apply one scenario script to all of its accounts. Returns the seconds it took.
+    """
+    email_pattern = "cc.value like '" + scenario_email(scenario, 0).replace('0000000@', '%@') + "'"
+    sql = EMAIL_PREDICATE_RE.sub(email_pattern, sql)
+    sql = SCALAR_SUBQUERY_RE.sub('contract_id in (select', sql)
+
+    start = time.time()
+    for sql_stmt in split_sql_stmts(sql):
+        connection.execute(translate_sql_for_sqlite(sql_stmt))
+    connection.commit()
+    return time.time() - start
+
+def account_states(connection, scenario, days_back):
+    """
+    Return {contract_id: ((email_verified, pp_status, sc_status), last_updated in the export window)}.
+    """
+    low = scenario_contract_id(scenario, 0)
+    cursor = connection.execute('''
+        select cc.contract_id, cc.status,
+            max(case when cs.service_type_id = 1 then cs.service_status_id end),
+            max(case when cs.service_type_id = 500 then cs.service_status_id end),
+            cc.last_updated between date('now', ?) and datetime('now', '-1 hours')
+        from GMS4.sms_customer_contacts cc
+            inner join GMS4.sms_customer_services cs on cs.contract_id = cc.contract_id
+        where cc.contract_id between ? and ?
+        group by cc.contract_id, cc.status, cc.last_updated''', (
+        '%d days' % days_back, low, low + 10000000 - 1))
+    states = {}
+    for (contract_id, email_verified, pp_status, sc_status, in_window) in cursor:
+        states[contract_id] = ((email_verified, pp_status, sc_status), bool(in_window))
+    return states
+
+def expected_state(replayed_state, in_window):
+    (scenario, target) = scenarios.SCENARIOS.get(replayed_state, (0, None))
+    if target and in_window:
+        return scenarios.TARGET_STATES[target]
+    return replayed_state
+
+def run_sync(options, work_dir, db_filename):
+    """
+    Run the export and sync. Returns (seconds, metrics summary).
+    """
+    args = [sys.executable, SCRIPT_FILENAME, '--path', work_dir, '--log_dir', os.path.join(work_dir, 'logs'),
+            '--backend', 'sqlite', '--dbname', db_filename, '--sync', '--days_back', str(options.days_back)]
+    console = open(os.path.join(work_dir, 'logs', 'sync.console'), 'a')
+    start = time.time()
+    returncode = subprocess.call(args + options.script_args.split(), cwd=work_dir, stdin=open(os.devnull),
+                                 stdout=console, stderr=console)
+    seconds = time.time() - start
+    console.close()
+    if returncode:
+        raise Exception('sync-pd-services.py failed, rc ' + str(returncode) + ', see ' + console.name)
+
+    fin = open(os.path.join(work_dir, 'logs', 'sync-pd-services.metrics.json'))
+    summary = json.load(fin)
+    fin.close()
+    return (seconds, summary)
+
+def replay(options, work_dir, scenario_files):
+    """
+    Replay scenario_files, [(scenario, filename), ...], into one replica and sync it.
+    Returns ([(scenario, accounts, replay seconds, in window, ok, mismatches), ...], sync seconds, metrics).
+    """
+    db_filename = os.path.join(work_dir, 'replica.sqlite')
+    scenario_numbers = [scenario for (scenario, filename) in scenario_files]
+    create_replica(db_filename, scenario_numbers, options.accounts, options.background)
+
+    connection = connect_replica(db_filename)
+    replayed = {}
+    for (scenario, filename) in scenario_files:
+        seconds = replay_scenario(connection, scenario, read_file(filename))
+        replayed[scenario] = (seconds, account_states(connection, scenario, options.days_back))
+    connection.close()
+
+    (sync_seconds, summary) = run_sync(options, work_dir, db_filename)
+
+    connection = connect_replica(db_filename)
+    results = []
+    for scenario in scenario_numbers:
+        (seconds, before) = replayed[scenario]
+        after = account_states(connection, scenario, options.days_back)
+        in_window = 0
+        mismatches = []
+        for (contract_id, (replayed_state, account_in_window)) in sorted(before.items()):
+            in_window += account_in_window
+            expected = expected_state(replayed_state, account_in_window)
+            final_state = after[contract_id][0]
+            if final_state != expected:
+                mismatches.append((contract_id, replayed_state, expected, final_state))
+        results.append((scenario, len(before), seconds, in_window, len(before) - len(mismatches), mismatches))
+    connection.close()
+
+    return (results, sync_seconds, summary)
+
+def report(results, sync_seconds, summary):
+    mismatch_count = 0
+    for (scenario, accounts, seconds, in_window, ok, mismatches) in results:
+        print('scenario %2d: %7d accounts, replay %7.3f s, %7d in window, %7d ok, %5d mismatched' % (
+            scenario, accounts, seconds, in_window, ok, len(mismatches)))
+        for (contract_id, replayed_state, expected, final_state) in mismatches[:5]:
+            print('    contract_id %d: replayed %s, expected %s, found %s' % (
+                contract_id, replayed_state, expected, final_state))
+        mismatch_count += len(mismatches)
+
+    phases = ', '.join(['%s %.2f' % (phase['phase'], phase['seconds']) for phase in summary['phases']])
+    print('sync %.2f s, %d rows, %d synced: %s' % (
+        sync_seconds, summary['counters'].get('rows', 0), summary['counters'].get('synced', 0), phases))
+    return mismatch_count
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--accounts', action='store', type='int', dest='accounts', default=DEFAULT_ACCOUNTS,
+                      help='Accounts per scenario (default=' + str(DEFAULT_ACCOUNTS) + ')')
+    parser.add_option('--background', action='store', type='int', dest='background', default=DEFAULT_BACKGROUND,
+                      help='In-sync accounts in the export window (default=' + str(DEFAULT_BACKGROUND) + ')')
+    parser.add_option('--scenarios', action='store', type='str', dest='scenarios', default=None,
+                      help='Comma separated scenario numbers (default: all persist-scenarios)')
+    parser.add_option('--days_back', action='store', type='int', dest='days_back', default=DEFAULT_DAYS_BACK,
+                      help='sync-pd-services.py --days_back (default=' + str(DEFAULT_DAYS_BACK) + ')')
+    parser.add_option('--separate', action='store_true', dest='separate', default=False,
+                      help='Replay and sync each scenario on its own replica, for per-scenario sync timing')
+    parser.add_option('--script_args', action='store', type='str', dest='script_args', default='',
+                      help='More sync-pd-services.py arguments, e.g. "--merge" or "--workers 4"')
+    parser.add_option('--keep', action='store_true', dest='keep', default=False,
+                      help='Keep the work directory, with the replica and the logs')
+    options, args = parser.parse_args()
+
+    scenario_files = []
+    for filename in glob.glob(os.path.join(SCENARIOS_DIR, 'scenario-*.sql')):
+        scenario_files.append((int(SCENARIO_FILENAME_RE.search(filename).group(1)), filename))
+    scenario_files.sort()
+    if options.scenarios:
+        wanted = [int(scenario) for scenario in options.scenarios.split(',')]
+        scenario_files = [(scenario, filename) for (scenario, filename) in scenario_files if scenario in wanted]
+
+    work_dir = tempfile.mkdtemp(prefix='replay-sync-pd-services-')
+    os.mkdir(os.path.join(work_dir, 'logs'))
+    for filename in SQL_FILENAMES:
+        shutil.copy(os.path.join(BASE_DIR, filename), work_dir)
+
+    mismatch_count = 0
+    try:
+        if options.separate:
+            for scenario_file in scenario_files:
+                mismatch_count += report(*replay(options, work_dir, [scenario_file]))
+        else:
+            mismatch_count = report(*replay(options, work_dir, scenario_files))
+    finally:
+        if options.keep:
+            print('Work directory: ' + work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+    if mismatch_count:
+        print('FAILED: ' + str(mismatch_count) + ' accounts mismatched')
+        sys.exit(1)
+    print('OK')
+
+if __name__ == "__main__":
+    main()
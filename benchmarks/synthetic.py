@@ -0,0 +1,124 @@
+#! /usr/bin/python
+
+"""
+  Synthetic, reproducible benchmark data modeled on scenarios.csv: an export DEL extract and a
+  SQLite replica of the GMS4 tables, for --backend sqlite, with the same players.
+
+  Each player is in sync (preactive or active, both services alike) or, with probability
+  --out_of_sync, in one of the scenarios.SCENARIOS states, picked uniformly. A --internal fraction
+  of the players have @calottery.com emails. The same --seed gives the same players.
+
+  Usage: python benchmarks/synthetic.py --rows N [--extract FILE] [--db FILE] [--out_of_sync F]
+"""
+import os
+import random
+import sqlite3
+import sys
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scenarios
+
+DEFAULT_ROWS = 100000
+DEFAULT_OUT_OF_SYNC = 0.05
+DEFAULT_INTERNAL = 0.01
+DEFAULT_SEED = 1
+FIRST_CONTRACT_ID = 3000000
+IN_SYNC_STATES = [scenarios.TARGET_STATES[scenarios.PREACTIVATE], scenarios.TARGET_STATES[scenarios.ACTIVATE]]
+LAST_UPDATED = '2026-01-01-00.00.00.000000'
+
+REPLICA_SCHEMA = '''
+create table sms_contracts (contract_id integer primary key, contract_identity varchar(10), contract_status_id integer);
+create table sms_customer_contacts (contract_id integer, contact_type_id integer, value varchar(128), status integer,
+    last_updated timestamp);
+create table sms_customer_services (contract_id integer, service_type_id integer, service_status_id integer,
+    last_updated date);
+create index sms_customer_contacts_ix on sms_customer_contacts (last_updated);
+create index sms_customer_contacts_contract_ix on sms_customer_contacts (contract_id);
+create index sms_customer_services_ix on sms_customer_services (contract_id);
+'''
+
+def generate_players(rows, out_of_sync=DEFAULT_OUT_OF_SYNC, internal=DEFAULT_INTERNAL, seed=DEFAULT_SEED):
+    """
+    Yield (contract_identity, account_email, contract_id, email_verified, pp_status, sc_status),
+    in account_email order like the export.
+    """
+    rand = random.Random(seed)
+    scenario_states = sorted(scenarios.SCENARIOS.keys())
+    for index in range(rows):
+        contract_id = FIRST_CONTRACT_ID + index
+        if rand.random() < out_of_sync:
+            (email_verified, pp_status, sc_status) = rand.choice(scenario_states)
+        else:
+            (email_verified, pp_status, sc_status) = rand.choice(IN_SYNC_STATES)
+
+        domain = '@example.com'
+        if rand.random() < internal:
+            domain = scenarios.INTERNAL_EMAIL_DOMAIN
+        account_email = 'player%09d%s' % (index, domain)
+
+        yield ('%010d' % (1000000000 + contract_id), account_email, contract_id, email_verified, pp_status, sc_status)
+
+def write_extract(filename, players):
+    """
+    Write the players as the DB2 EXPORT OF DEL of export-sync-pd-services.sql would.
+    """
+    fout = open(filename, 'w')
+    lines = []
+    for (contract_identity, account_email, contract_id, email_verified, pp_status, sc_status) in players:
+        lines.append('"%s","%s",+%010d.,+%d.,"1, 500","%d, %d","%s"\n' % (
+            contract_identity, account_email, contract_id, email_verified, pp_status, sc_status, LAST_UPDATED))
+        if len(lines) >= 10000:
+            fout.write(''.join(lines))
+            lines = []
+    fout.write(''.join(lines))
+    fout.close()
+
+def write_replica_db(filename, players):
+    """
+    Create a SQLite replica of the GMS4 tables holding the players, all updated six hours ago.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    connection = sqlite3.connect(filename)
+    connection.executescript(REPLICA_SCHEMA)
+    contracts = []
+    contacts = []
+    services = []
+    for (contract_identity, account_email, contract_id, email_verified, pp_status, sc_status) in players:
+        contracts.append((contract_id, contract_identity))
+        contacts.append((contract_id, account_email, email_verified))
+        services.append((contract_id, 1, pp_status))
+        services.append((contract_id, 500, sc_status))
+
+    connection.executemany('insert into sms_contracts values (?, ?, 1)', contracts)
+    connection.executemany("insert into sms_customer_contacts values (?, 1, ?, ?, datetime('now', '-6 hours'))",
+                           contacts)
+    connection.executemany("insert into sms_customer_services values (?, ?, ?, date('now', '-1 day'))", services)
+    connection.commit()
+    connection.close()
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--rows', action='store', type='int', dest='rows', default=DEFAULT_ROWS)
+    parser.add_option('--out_of_sync', action='store', type='float', dest='out_of_sync', default=DEFAULT_OUT_OF_SYNC)
+    parser.add_option('--internal', action='store', type='float', dest='internal', default=DEFAULT_INTERNAL)
+    parser.add_option('--seed', action='store', type='int', dest='seed', default=DEFAULT_SEED)
+    parser.add_option('--extract', action='store', type='str', dest='extract', default=None, metavar='FILE')
+    parser.add_option('--db', action='store', type='str', dest='db', default=None, metavar='FILE')
+    options, args = parser.parse_args()
+
+    if not options.extract and not options.db:
+        parser.error('--extract and/or --db required')
+
+    if options.extract:
+        write_extract(options.extract,
+                      generate_players(options.rows, options.out_of_sync, options.internal, options.seed))
+    if options.db:
+        write_replica_db(options.db,
+                         generate_players(options.rows, options.out_of_sync, options.internal, options.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+  Sync checkpoint: a journal of every committed contract_id, and a rejects file of rows that
+  failed on their own. A --resume run skips the journaled contracts.
+"""
+import os
+import threading
+
+class Checkpoint(object):
+    def __init__(self, journal_filename, rejects_filename):
+        self.journal_filename = journal_filename
+        self.rejects_filename = rejects_filename
+        self.done = set()
+        self.rejected_count = 0
+        self.rejected_last_updated = []
+        self.lock = threading.Lock()
+        self.journal = None
+        self.rejects = None
+
+    def start(self, resume):
+        """
+        Open the journal, loading it if resume else starting a new one. Rejects always start empty.
+        """
+        if resume and os.path.exists(self.journal_filename):
+            fin = open(self.journal_filename, 'r')
+            for line in fin:
+                tokens = line.split()
+                if len(tokens) == 2:
+                    self.done.add(tokens[1])
+            fin.close()
+
+        self.journal = open(self.journal_filename, resume and 'a' or 'w')
+        self.rejects = open(self.rejects_filename, 'w')
+        return len(self.done)
+
+    def is_done(self, contract_id):
+        return contract_id in self.done
+
+    def commit(self, batch_number, fixed_players):
+        """
+        Journal a committed batch, one 'batch_number contract_id' line per player, synced to disk.
+        """
+        lines = ['%s %s\n' % (batch_number, fixed_player.contractId) for fixed_player in fixed_players]
+        self.lock.acquire()
+        try:
+            self.journal.write(''.join(lines))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        finally:
+            self.lock.release()
+
+    def reject(self, batch_number, fixed_player, error):
+        self.lock.acquire()
+        try:
+            self.rejects.write('%s, %s, %s\n' % (batch_number, fixed_player, error))
+            self.rejects.flush()
+            self.rejected_count += 1
+            self.rejected_last_updated.append(fixed_player.last_updated)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        for fout in (self.journal, self.rejects):
+            if fout:
+                fout.close()
+        self.journal = None
+        self.rejects = None
@@ -0,0 +1,63 @@
+"""
+  Generated export query: the scenario table encoded as SQL CASE expressions, so the database
+  returns only the accounts that need a fix, with their scenario and target statuses.
+  See export-fixes-sync-pd-services.sqlt.
+"""
+import re
+
+import scenarios
+
+# Export SQLT placeholder: index of its status in the scenarios.TARGET_STATES tuples.
+TARGET_PLACEHOLDERS = [
+    ('TargetEmailVerifiedCase', 0),
+    ('TargetPortalServiceCase', 1),
+    ('TargetSecondChanceServiceCase', 2)
+]
+
+def fixable_scenarios():
+    """
+    Return [((emailVerified, portalService, secondChanceService), scenario, target), ...] for the
+    scenarios with a target, in scenario order.
+    """
+    fixable = []
+    for (statuses, (scenario, target)) in scenarios.SCENARIOS.items():
+        if target:
+            fixable.append((statuses, scenario, target))
+    fixable.sort(key=lambda item: item[1])
+    return fixable
+
+def scenario_case(email_verified_col, pp_status_col, sc_status_col):
+    """
+    SQL CASE giving the scenario number of a fixable account, null otherwise.
+    """
+    whens = []
+    for ((email_verified, pp_status, sc_status), scenario, target) in fixable_scenarios():
+        whens.append('when %s = %d and %s = %d and %s = %d then %d' % (
+            email_verified_col, email_verified, pp_status_col, pp_status, sc_status_col, sc_status, scenario))
+    return 'case ' + ' '.join(whens) + ' end'
+
+def target_case(scenario_col, target_index):
+    """
+    SQL CASE giving one target status, TARGET_STATES[target][target_index], of a scenario.
+    """
+    whens = []
+    for (statuses, scenario, target) in fixable_scenarios():
+        whens.append('when %d then %d' % (scenario, scenarios.TARGET_STATES[target][target_index]))
+    return 'case ' + scenario_col + ' ' + ' '.join(whens) + ' end'
+
+def generate_export_sql(sqlt):
+    """
+    Fill in the export SQLT placeholders from the scenario table.
+    """
+    values = {
+        'ScenarioCase': scenario_case('EMAIL_VERIFIED', 'PP_STATUS', 'SC_STATUS'),
+        'InternalEmailPattern': "'%" + scenarios.INTERNAL_EMAIL_DOMAIN + "%'"
+    }
+    for (name, target_index) in TARGET_PLACEHOLDERS:
+        values[name] = target_case('SCENARIO', target_index)
+
+    placeholder_re = re.compile(r'\b(' + '|'.join(values.keys()) + r')\b')
+    if len(set(placeholder_re.findall(sqlt))) != len(values):
+        raise Exception('Export SQLT is missing placeholders, expected: ' + ', '.join(sorted(values.keys())))
+
+    return placeholder_re.sub(lambda match: values[match.group(1)], sqlt)
@@ -0,0 +1,67 @@
+"""
+  Export DEL extract reader: one pass over the sync-pd-services.csv lines, parsed with the csv
+  module, yielding typed rows or PlayerBatch objects. Gzip-compressed archives are read as is.
+"""
+import csv
+import gzip
+import os
+import shutil
+
+from player import PlayerBatch, parse_del_row
+
+HEADING_FIELD = 'CONTRACT_IDENTITY'
+DEFAULT_BATCH_ROWS = 10000
+ARCHIVE_COMPRESSLEVEL = 6
+
+def read_extract(filename):
+    """
+    Yield the lines of an export DEL file in a single pass.
+    A .gz file, a compressed archive, is decompressed as it is read.
+    """
+    if filename.endswith('.gz'):
+        csv_file = gzip.open(filename, 'rb')
+        for csv_line in csv_file:
+            if not isinstance(csv_line, str):
+                csv_line = csv_line.decode('utf-8')
+            yield csv_line
+        csv_file.close()
+        return
+
+    csv_file = open(filename)
+    for csv_line in csv_file:
+        yield csv_line
+    csv_file.close()
+
+def compress_extract(filename, gz_filename):
+    """
+    Move an extract into a gzip-compressed archive.
+    """
+    fin = open(filename, 'rb')
+    fout = gzip.open(gz_filename, 'wb', ARCHIVE_COMPRESSLEVEL)
+    shutil.copyfileobj(fin, fout)
+    fout.close()
+    fin.close()
+    os.remove(filename)
+
+def iter_rows(csv_lines):
+    """
+    Yield typed parse_del_row() tuples, skipping any column-heading row.
+    """
+    for fields in csv.reader(csv_lines):
+        if not fields or fields[0] == HEADING_FIELD:
+            continue
+        yield parse_del_row(fields)
+
+def iter_batches(csv_lines, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    Yield PlayerBatch objects of up to batch_rows rows.
+    """
+    batch = PlayerBatch()
+    for row in iter_rows(csv_lines):
+        batch.append_row(row)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = PlayerBatch()
+
+    if len(batch):
+        yield batch
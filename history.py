@@ -0,0 +1,175 @@
+"""
+  Archived extract history: --nodb analysis of many archived sync-pd-services.csv.<date>[.<time>][.gz]
+  extracts at once, one file per process, aggregated into scenario counts per day, repeat-offender
+  contracts and the trend of out-of-sync volume. A --daemon archives an extract per cycle, with a
+  time suffix; the extracts of one date count as one day.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import re
+
+from extract import iter_batches, read_extract
+
+# sync-pd-services.csv.2026-10-18, sync-pd-services.csv.2026-10-18.gz or sync-pd-services.csv.2026-10-18.143000.gz
+ARCHIVE_DATE_RE = re.compile(r'\.(\d{4}-\d{2}-\d{2})(\.\d{6})?(\.gz)?$')
+REPEAT_OFFENDERS_REPORTED = 20
+
+def archive_date(filename):
+    match = ARCHIVE_DATE_RE.search(filename)
+    return match and match.group(1) or os.path.basename(filename)
+
+def find_archives(pattern, since=None, until=None):
+    """
+    Return the archive filenames matching the glob pattern, between the since and until dates
+    (YYYY-MM-DD, inclusive), in date order.
+    """
+    filenames = []
+    for filename in glob.glob(pattern):
+        date = archive_date(filename)
+        if (since and date < since) or (until and date > until):
+            continue
+        filenames.append((date, filename))
+    filenames.sort()
+    return [filename for (date, filename) in filenames]
+
+def analyze_extract(filename):
+    """
+    Classify one extract. Returns a dict: date, filename, rows, out_of_sync (rows with a fix),
+    scenarios {scenario: rows}, and contracts [(contract_id, scenario), ...] of the out-of-sync rows.
+    Runs in a worker process.
+    """
+    rows = 0
+    scenario_counts = {}
+    contracts = []
+    for batch in iter_batches(read_extract(filename)):
+        batch.classify()
+        rows += len(batch)
+        for index in range(len(batch)):
+            scenario = int(batch.scenarios[index])
+            scenario_counts[scenario] = scenario_counts.get(scenario, 0) + 1
+            if batch.targets[index]:
+                contracts.append((batch.contract_ids[index], scenario))
+
+    return {
+        'date': archive_date(filename),
+        'filename': filename,
+        'rows': rows,
+        'out_of_sync': len(contracts),
+        'scenarios': scenario_counts,
+        'contracts': contracts
+    }
+
+def analyze_history(filenames, processes=None):
+    """
+    Analyze the extracts in parallel, processes of them at a time (default: one per CPU).
+    Returns the analyze_extract results in filename order.
+    """
+    if not filenames:
+        return []
+
+    processes = min(processes or multiprocessing.cpu_count(), len(filenames))
+    if processes == 1:
+        return [analyze_extract(filename) for filename in filenames]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(analyze_extract, filenames, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def trend_per_day(values):
+    """
+    Least-squares slope of values over their index, out-of-sync rows per day.
+    """
+    count = len(values)
+    if count < 2:
+        return 0.0
+    mean_x = (count - 1) / 2.0
+    mean_y = sum(values) / float(count)
+    covariance = sum([(x - mean_x) * (y - mean_y) for (x, y) in enumerate(values)])
+    variance = sum([(x - mean_x) ** 2 for x in range(count)])
+    return covariance / variance
+
+def results_per_day(results):
+    """
+    Merge the results of the extracts archived on the same date, in date order. A contract out of
+    sync in several of them is listed once, with its latest scenario.
+    """
+    days = []
+    by_date = {}
+    for result in results:
+        day = by_date.get(result['date'])
+        if day is None:
+            day = {'date': result['date'], 'rows': 0, 'scenarios': {}, 'contracts': {}}
+            by_date[result['date']] = day
+            days.append(day)
+        day['rows'] += result['rows']
+        for (scenario, count) in result['scenarios'].items():
+            day['scenarios'][scenario] = day['scenarios'].get(scenario, 0) + count
+        for (contract_id, scenario) in result['contracts']:
+            day['contracts'][contract_id] = scenario
+
+    for day in days:
+        day['contracts'] = sorted(day['contracts'].items())
+        day['out_of_sync'] = len(day['contracts'])
+    return days
+
+def summarize_history(results):
+    """
+    Aggregate the results per day: the days, totals, repeat offenders and trend.
+    """
+    days = []
+    totals = {}
+    offender_days = {}
+    previous = None
+    for result in results_per_day(results):
+        for (scenario, count) in result['scenarios'].items():
+            totals[scenario] = totals.get(scenario, 0) + count
+        for (contract_id, scenario) in result['contracts']:
+            offender_days.setdefault(contract_id, []).append((result['date'], scenario))
+
+        days.append({
+            'date': result['date'],
+            'rows': result['rows'],
+            'out_of_sync': result['out_of_sync'],
+            'change': previous is not None and result['out_of_sync'] - previous or 0,
+            'scenarios': dict([(str(scenario), count) for (scenario, count) in sorted(result['scenarios'].items())])
+        })
+        previous = result['out_of_sync']
+
+    offenders = [(len(dates), contract_id, dates) for (contract_id, dates) in offender_days.items() if len(dates) > 1]
+    offenders.sort(key=lambda offender: (-offender[0], offender[1]))
+
+    return {
+        'days': days,
+        'rows': sum([day['rows'] for day in days]),
+        'out_of_sync': sum([day['out_of_sync'] for day in days]),
+        'scenarios': dict([(str(scenario), count) for (scenario, count) in sorted(totals.items())]),
+        'trend_per_day': trend_per_day([day['out_of_sync'] for day in days]),
+        'repeat_offender_count': len(offenders),
+        'repeat_offenders': [{'contract_id': contract_id, 'days': count, 'dates': dates}
+                             for (count, contract_id, dates) in offenders[:REPEAT_OFFENDERS_REPORTED]]
+    }
+
+def report_history(logger, summary, json_filename=None):
+    for day in summary['days']:
+        scenarios = ' '.join(['%s:%s' % (scenario, count) for (scenario, count) in
+                              sorted(day['scenarios'].items(), key=lambda item: int(item[0]))])
+        logger.info('%s %8d rows %7d out of sync (%+d)  scenarios %s' % (
+            day['date'], day['rows'], day['out_of_sync'], day['change'], scenarios))
+
+    logger.info('%d days, %d rows, %d out of sync, trend %+.1f out of sync per day' % (
+        len(summary['days']), summary['rows'], summary['out_of_sync'], summary['trend_per_day']))
+    logger.info(str(summary['repeat_offender_count']) + ' contracts out of sync on more than one day')
+    for offender in summary['repeat_offenders']:
+        logger.info('  contract_id %s: %d days, %s' % (offender['contract_id'], offender['days'], ', '.join(
+            ['%s scenario %s' % (date, scenario) for (date, scenario) in offender['dates']])))
+
+    if json_filename:
+        fout = open(json_filename, 'w')
+        fout.write(json.dumps(summary, indent=2, sort_keys=True) + '\n')
+        fout.close()
+        logger.verbose('History report: ' + json_filename)
@@ -0,0 +1,86 @@
+"""
+  Incremental export high-water mark: the newest contact last_updated timestamp already
+  processed, persisted in a small local state file between runs. The mark is kept in the DB2
+  timestamp format whichever backend exported it.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+# DB2 (2026-10-18-05.32.49.000000) or DB-API (2026-10-18 05:32:49) timestamps. They don't sort as
+# text against each other, '-' > ' ': compare them in the canonical DB2 format.
+TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}[ -]\d{2}[.:]\d{2}[.:]\d{2}(\.\d+)?$')
+DB2_TIMESTAMP_FORMAT = '%Y-%m-%d-%H.%M.%S.%f'
+
+def canonical_timestamp(timestamp):
+    """
+    Return a DB2 or DB-API timestamp in the DB2 format, microseconds included, which sorts as text.
+    """
+    return '%s-%s.%s' % (timestamp[:10], timestamp[11:19].replace(':', '.'), (timestamp[20:] + '000000')[:6])
+
+def timestamp_before(timestamp):
+    """
+    Return the canonical timestamp one microsecond before a canonical timestamp.
+    """
+    return (datetime.strptime(timestamp, DB2_TIMESTAMP_FORMAT) - timedelta(microseconds=1)).strftime(
+        DB2_TIMESTAMP_FORMAT)
+
+class HighWaterMark(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.mark = None
+        self.seen = None
+
+    def load(self):
+        if os.path.exists(self.filename):
+            fin = open(self.filename, 'r')
+            mark = fin.read().strip()
+            fin.close()
+            if not TIMESTAMP_RE.match(mark):
+                raise Exception('Invalid high-water mark in ' + self.filename + ': ' + mark)
+            self.mark = canonical_timestamp(mark)
+        return self.mark
+
+    def observe(self, timestamp):
+        if TIMESTAMP_RE.match(timestamp):
+            timestamp = canonical_timestamp(timestamp)
+            if self.seen is None or timestamp > self.seen:
+                self.seen = timestamp
+
+    def observe_lines(self, csv_lines):
+        """
+        Pass export DEL lines through, observing their last column, LAST_UPDATED (EXPORT_LAST_UPDATED,
+        the newest of the whole window, in a --prefilter export).
+        """
+        for csv_line in csv_lines:
+            self.observe(csv_line.rstrip().rsplit(',', 1)[-1].strip('"'))
+            yield csv_line
+
+    def hold_below(self, timestamps):
+        """
+        Keep the next save before the oldest of timestamps, the last_updated of rows that must be
+        exported again. The mark stays put if one of them is not a timestamp.
+        """
+        for timestamp in timestamps:
+            if not timestamp or not TIMESTAMP_RE.match(timestamp):
+                self.seen = None
+                return
+            before = timestamp_before(canonical_timestamp(timestamp))
+            if self.seen is not None and before < self.seen:
+                self.seen = before
+
+    def save(self):
+        """
+        Advance the persisted mark to the newest timestamp seen, if any. Returns the mark.
+        """
+        if self.seen is None or (self.mark is not None and self.seen <= self.mark):
+            return self.mark
+
+        temp_filename = self.filename + '.tmp'
+        fout = open(temp_filename, 'w')
+        fout.write(self.seen + '\n')
+        fout.close()
+        os.rename(temp_filename, self.filename)
+
+        self.mark = self.seen
+        return self.mark
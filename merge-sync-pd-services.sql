@@ -0,0 +1,20 @@
+-- Set-based sync: apply every fix staged in SESSION.SYNC_PD_FIXES in one pass per table.
+-- SESSION.SYNC_PD_FIXES( contract_id, email_verified, service_status_id ) is declared
+-- and loaded by sync-pd-services.py --merge. Requires a USER TEMPORARY tablespace.
+
+update GMS4.sms_customer_contacts
+set status = (
+    select f.email_verified from SESSION.SYNC_PD_FIXES f
+        where f.contract_id = GMS4.sms_customer_contacts.contract_id
+    )
+where contract_id in (select f.contract_id from SESSION.SYNC_PD_FIXES f);
+
+update GMS4.sms_customer_services
+set service_status_id = (
+    select f.service_status_id from SESSION.SYNC_PD_FIXES f
+        where f.contract_id = GMS4.sms_customer_services.contract_id
+    ),
+    last_updated = CURRENT_DATE
+where contract_id in (select f.contract_id from SESSION.SYNC_PD_FIXES f);
+
+commit;
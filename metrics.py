@@ -0,0 +1,182 @@
+"""
+  Run metrics: wall time per phase, row counts and rates, scenario counts and sync latency
+  histograms, written at the end of every run as JSON and as a Prometheus node_exporter textfile.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Sync batch latency histogram bucket upper bounds, seconds.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for (index, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+class Metrics(object):
+    """
+    Thread-safe: sync workers observe their batch latencies concurrently.
+    Phases are wall times; the streamed stages (parse, classify) are accumulated across batches.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.started = time.time()
+        self.phases = []
+        self.phase_seconds = {}
+        self.counters = {}
+        self.scenarios = {}
+        self.histograms = {}
+        self.labels = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        self.lock.acquire()
+        try:
+            if phase not in self.phase_seconds:
+                self.phases.append(phase)
+                self.phase_seconds[phase] = 0.0
+            self.phase_seconds[phase] += seconds
+        finally:
+            self.lock.release()
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def count(self, name, value=1):
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self.lock.release()
+
+    def count_scenarios(self, scenarios):
+        counts = {}
+        for scenario in scenarios:
+            counts[scenario] = counts.get(scenario, 0) + 1
+
+        self.lock.acquire()
+        try:
+            for (scenario, count) in counts.items():
+                scenario = int(scenario)
+                self.scenarios[scenario] = self.scenarios.get(scenario, 0) + count
+        finally:
+            self.lock.release()
+
+    def observe(self, name, seconds):
+        self.lock.acquire()
+        try:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+        finally:
+            self.lock.release()
+
+    def summary(self, success):
+        """
+        Return the metrics as a JSON-ready dict.
+        """
+        wall_seconds = time.time() - self.started
+        rows = self.counters.get('rows', 0)
+        process_seconds = self.phase_seconds.get('parse', 0.0) + self.phase_seconds.get('classify', 0.0)
+
+        histograms = {}
+        for (name, histogram) in self.histograms.items():
+            histograms[name] = {
+                'buckets': [[bound, count] for (bound, count) in zip(histogram.buckets, histogram.cumulative_counts())],
+                'count': histogram.count,
+                'sum': histogram.sum
+            }
+
+        return {
+            'started': self.started,
+            'wall_seconds': wall_seconds,
+            'success': success,
+            'labels': self.labels,
+            'phases': [{'phase': phase, 'seconds': self.phase_seconds[phase]} for phase in self.phases],
+            'counters': self.counters,
+            'rows_per_second': wall_seconds and rows / wall_seconds or 0.0,
+            'process_rows_per_second': process_seconds and rows / process_seconds or 0.0,
+            'scenarios': dict([(str(scenario), count) for (scenario, count) in self.scenarios.items()]),
+            'histograms': histograms
+        }
+
+    def prometheus_text(self, summary):
+        prefix = self.prefix
+        labels = ''.join([',%s="%s"' % (name, value) for (name, value) in sorted(self.labels.items())])
+        run_labels = labels and '{' + labels[1:] + '}'
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            for (sample_labels, value) in samples:
+                lines.append('%s_%s%s %s' % (prefix, name, sample_labels, value))
+
+        gauge('last_run_timestamp_seconds', 'Start time of the last run.', [(run_labels, '%.3f' % summary['started'])])
+        gauge('last_run_success', '1 if the last run succeeded.', [(run_labels, int(summary['success']))])
+        gauge('wall_seconds', 'Wall time of the last run.', [(run_labels, '%.6f' % summary['wall_seconds'])])
+        gauge('phase_seconds', 'Wall time per phase of the last run.',
+              [('{phase="%s"%s}' % (phase['phase'], labels), '%.6f' % phase['seconds'])
+               for phase in summary['phases']])
+        gauge('rows_per_second', 'Exported rows per second of run wall time.',
+              [(run_labels, '%.3f' % summary['rows_per_second'])])
+        gauge('process_rows_per_second', 'Exported rows per second of parse and classify time.',
+              [(run_labels, '%.3f' % summary['process_rows_per_second'])])
+        for name in sorted(self.counters.keys()):
+            gauge(name, 'Count of ' + name + ' in the last run.', [(run_labels, self.counters[name])])
+        gauge('scenario_rows', 'Exported rows per scenario, 0 = none, in the last run.',
+              [('{scenario="%s"%s}' % (scenario, labels), self.scenarios[scenario])
+               for scenario in sorted(self.scenarios.keys())])
+
+        for name in sorted(self.histograms.keys()):
+            histogram = self.histograms[name]
+            lines.append('# HELP %s_%s Latency, seconds, in the last run.' % (prefix, name))
+            lines.append('# TYPE %s_%s histogram' % (prefix, name))
+            for (bound, count) in zip(histogram.buckets, histogram.cumulative_counts()):
+                lines.append('%s_%s_bucket{le="%s"%s} %d' % (prefix, name, bound, labels, count))
+            lines.append('%s_%s_bucket{le="+Inf"%s} %d' % (prefix, name, labels, histogram.count))
+            lines.append('%s_%s_sum%s %.6f' % (prefix, name, run_labels, histogram.sum))
+            lines.append('%s_%s_count%s %d' % (prefix, name, run_labels, histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_filename, prom_filename, success):
+        """
+        Write both files, each to a temporary file renamed into place, so a scrape never sees half a file.
+        """
+        summary = self.summary(success)
+        for (filename, text) in ((json_filename, json.dumps(summary, indent=2, sort_keys=True) + '\n'),
+                                 (prom_filename, self.prometheus_text(summary))):
+            temp_filename = filename + '.tmp'
+            fout = open(temp_filename, 'w')
+            fout.write(text)
+            fout.close()
+            os.rename(temp_filename, filename)
+
+        return summary
@@ -0,0 +1,96 @@
+"""
+  Sync plan: the fixes a --find or --nodb run would apply, one JSON object per line, for review
+  and a later --apply_plan run without a new export. Each line holds a contract's identity, its
+  scenario, its current and target [emailVerified, portalService, secondChanceService], and when
+  it was planned. A .gz plan is written and read gzip-compressed.
+"""
+import gzip
+import json
+import os
+import time
+
+from player import Player
+from scenarios import TARGET_STATES
+
+PLAN_SEPARATORS = (',', ':')
+PLANNED_AT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def open_plan(filename, mode, compressed):
+    if compressed:
+        return gzip.open(filename, mode + 'b')
+    return open(filename, mode)
+
+def player_states(player):
+    return [int(player.emailVerified), int(player.portalService), int(player.secondChanceService)]
+
+class PlanWriter(object):
+    """
+    Write a plan to a temporary file, renamed to filename on close, so a failed run leaves no partial plan.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.temp_filename = filename + '.tmp'
+        self.compressed = filename.endswith('.gz')
+        self.planned_at = time.strftime(PLANNED_AT_FORMAT)
+        self.plan = open_plan(self.temp_filename, 'w', self.compressed)
+        self.count = 0
+
+    def write(self, player, fixed_player):
+        line = json.dumps({
+            'contract_identity': player.contract_identity,
+            'account_email': player.account_email,
+            'contract_id': int(player.contract_id),
+            'scenario': int(fixed_player.scenario),
+            'current': player_states(player),
+            'planned_at': self.planned_at,
+            'target': player_states(fixed_player)
+        }, separators=PLAN_SEPARATORS, sort_keys=True) + '\n'
+        if self.compressed:
+            line = line.encode('utf-8')
+        self.plan.write(line)
+        self.count += 1
+
+    def close(self):
+        self.plan.close()
+        os.rename(self.temp_filename, self.filename)
+        return self.count
+
+def read_plan(filename, max_age=None):
+    """
+    Return the [(player, fixed_player), ...] of a whole plan, validated before any is applied.
+    Raise exception on a line whose target is not the state a scenario syncs to, so an edited plan
+    can't apply arbitrary statuses, or on a line planned more than max_age seconds ago, as its
+    current states may have changed since.
+    """
+    target_states = [list(states) for states in TARGET_STATES.values()]
+    fixes = []
+    plan = open_plan(filename, 'r', filename.endswith('.gz'))
+    try:
+        line_number = 0
+        for line in plan:
+            line_number += 1
+            if not isinstance(line, str):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+
+            try:
+                fix = json.loads(line)
+                fields = (fix['contract_identity'], fix['account_email'], str(fix['contract_id']))
+                (current, target) = (fix['current'], fix['target'])
+                scenario = fix['scenario']
+                planned_at = time.mktime(time.strptime(fix['planned_at'], PLANNED_AT_FORMAT))
+            except (ValueError, KeyError, TypeError) as error:
+                raise Exception('Invalid plan line %d in %s: %s' % (line_number, filename, error))
+            if max_age and time.time() - planned_at > max_age:
+                raise Exception('Stale plan %s: planned at %s, more than %g hours ago' % (
+                    filename, fix['planned_at'], max_age / 3600.0))
+            if target not in target_states or target == current:
+                raise Exception('Invalid plan line %d in %s: target %s' % (line_number, filename, target))
+
+            player = Player.from_fields(*(fields + tuple([str(status) for status in current]) + (scenario,)))
+            fixed_player = Player.from_fields(*(fields + tuple([str(status) for status in target]) + (scenario,)))
+            fixes.append((player, fixed_player))
+    finally:
+        plan.close()
+    return fixes
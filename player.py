@@ -1,18 +1,108 @@
-import copy
+import csv
+from array import array
+
+import scenarios
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+PLAYER_FIELDS = ('contract_identity', 'account_email', 'contract_id', 'email_verified_status', 'pp_status',
+                 'sc_status', 'scenario')
+
+PP_SERVICE_TYPE_ID = 1
+SC_SERVICE_TYPE_ID = 500
+
+# Export DEL columns, see export-sync-pd-services.sql.
+CONTRACT_IDENTITY_COL = 0
+ACCOUNT_EMAIL_COL = 1
+CONTRACT_ID_COL = 2
+EMAIL_VERIFIED_COL = 3
+SERVICE_TYPE_IDS_COL = 4
+SERVICE_STATUS_IDS_COL = 5
+LAST_UPDATED_COL = 6
+
+# The usual listagg layout, parsed without splitting the service type ids.
+PP_SC_SERVICE_TYPE_IDS = '%d, %d' % (PP_SERVICE_TYPE_ID, SC_SERVICE_TYPE_ID)
+
+# scenario, contract_identity, contract_id, emailVerified, portalService, secondChanceService, username
+PLAYER_FORMAT = '%s, %s, %s, %s, %s, %s, %s'
+
+# Largest status a PlayerBatch status column, array('B'), holds. 0 is a valid emailVerified (not verified),
+# so an unknown one is stored as a value no scenario matches instead.
+SMALL_INT_MAX = 255
+UNKNOWN_EMAIL_VERIFIED = SMALL_INT_MAX
+
+def parse_del_row(fields):
+    """
+    Return typed (contract_identity, account_email, contract_id, email_verified_status, pp_status, sc_status,
+    last_updated) from the csv-split fields of one export row. Service statuses are matched to their
+    service type, a missing service is status 0. last_updated is None if the row has no such column.
+    """
+    if fields[SERVICE_TYPE_IDS_COL] == PP_SC_SERVICE_TYPE_IDS:
+        (pp_status, sc_status) = fields[SERVICE_STATUS_IDS_COL].split(',')
+        pp_status = int(pp_status)
+        sc_status = int(sc_status)
+    else:
+        pp_status = 0
+        sc_status = 0
+        service_type_ids = fields[SERVICE_TYPE_IDS_COL].split(',')
+        service_status_ids = fields[SERVICE_STATUS_IDS_COL].split(',')
+        for (service_type_id, service_status_id) in zip(service_type_ids, service_status_ids):
+            service_type_id = int(service_type_id)
+            if service_type_id == PP_SERVICE_TYPE_ID:
+                pp_status = int(service_status_id)
+            elif service_type_id == SC_SERVICE_TYPE_ID:
+                sc_status = int(service_status_id)
+
+    # DB2 DEL numbers look like +0007321769. ; int() takes the sign and leading zeros as is.
+    return (
+        fields[CONTRACT_IDENTITY_COL],
+        fields[ACCOUNT_EMAIL_COL],
+        int(fields[CONTRACT_ID_COL].rstrip('.')),
+        int(fields[EMAIL_VERIFIED_COL].rstrip('.')),
+        pp_status,
+        sc_status,
+        len(fields) > LAST_UPDATED_COL and fields[LAST_UPDATED_COL] or None
+    )
+
+def parse_csv_line(csv_line):
+    return parse_del_row(next(csv.reader([csv_line])))
 
 class Player(object):
-    def __init__(self, csv_line):
-        tokens = csv_line.strip().replace('"', '').split(',')
-        self.contract_identity = tokens[0]
-        self.account_email = tokens[1]
-        self.contract_id = str(
-            int(tokens[2].replace('+', '').replace('.', '')))
-        self.email_verified_status = str(int(
-            tokens[3].replace('+', '').replace('.', '')))
-        self.pp_status = tokens[6].strip()
-        self.sc_status = tokens[7].strip()
+    __slots__ = PLAYER_FIELDS + ('last_updated',)
+
+    def __init__(self, csv_line=None):
+        self.last_updated = None
+        if csv_line is not None:
+            self.set_row(parse_csv_line(csv_line))
         self.scenario = 0
 
+    @classmethod
+    def from_fields(cls, contract_identity, account_email, contract_id, email_verified_status, pp_status, sc_status,
+                    scenario=0):
+        player = cls()
+        player.contract_identity = contract_identity
+        player.account_email = account_email
+        player.contract_id = contract_id
+        player.email_verified_status = email_verified_status
+        player.pp_status = pp_status
+        player.sc_status = sc_status
+        player.scenario = scenario
+        return player
+
+    def set_row(self, row):
+        """
+        Set the fields from a typed parse_del_row() tuple.
+        """
+        (self.contract_identity, self.account_email, contract_id, email_verified_status, pp_status, sc_status,
+         self.last_updated) = row
+        self.contract_id = str(contract_id)
+        self.email_verified_status = str(email_verified_status)
+        self.pp_status = str(pp_status)
+        self.sc_status = str(sc_status)
+
     def get_contract_identity(self): return self.contract_identity
     def set_contract_identity(self, contract_identity): self.contract_identity = contract_identity
     contractIdentity = property(get_contract_identity, set_contract_identity)
@@ -41,21 +131,6 @@ class Player(object):
     def set_scenario(self, scenario): self.scenario = scenario
     Scenario = property(get_scenario, set_scenario)
 
-    def preactivate(self):
-        self.email_verified_status = '0'
-        self.pp_status = '1'
-        self.sc_status = '1'
-
-    def activate(self):
-        self.email_verified_status = '1'
-        self.pp_status = '2'
-        self.sc_status = '2'
-
-    def suspend(self):
-        self.email_verified_status = '1'
-        self.pp_status = '3'
-        self.sc_status = '3'
-
     def __ne__(self, other):
         not_equal = False
 
@@ -91,16 +166,161 @@ class Player(object):
         return is_equal
 
     def __str__(self):
-        format = '%s, %s, %s, %s, %s, %s, %s'
-        return format % (
-            str(self.scenario),
-            self.contract_identity,
-            self.contract_id,
-            self.email_verified_status,
-            self.pp_status,
-            self.sc_status,
-            self.account_email
-        )
+        return format_player(self)
+
+def format_player(player):
+    return PLAYER_FORMAT % (
+        str(player.scenario),
+        player.contract_identity,
+        player.contract_id,
+        player.email_verified_status,
+        player.pp_status,
+        player.sc_status,
+        player.account_email
+    )
+
+class PlayerView(object):
+    """
+    Read-only view of one exported PlayerBatch row, used in place of a Player. Nothing is copied.
+    """
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def statuses(self):
+        """
+        Return the (emailVerified, portalService, secondChanceService) ints of the row.
+        """
+        index = self.index
+        return (self.batch.email_verified[index], self.batch.pp_status[index], self.batch.sc_status[index])
+
+    def _scenario(self):
+        if self.batch.scenarios is None:
+            return 0
+        return int(self.batch.scenarios[self.index])
+
+    contract_identity = property(lambda self: self.batch.contract_identities[self.index])
+    account_email = property(lambda self: self.batch.account_emails[self.index])
+    contract_id = property(lambda self: str(self.batch.contract_ids[self.index]))
+    last_updated = property(lambda self: self.batch.last_updated[self.index])
+    email_verified_status = property(lambda self: str(self.statuses()[0]))
+    pp_status = property(lambda self: str(self.statuses()[1]))
+    sc_status = property(lambda self: str(self.statuses()[2]))
+    scenario = property(_scenario)
+
+    contractIdentity = contract_identity
+    contractId = contract_id
+    username = account_email
+    emailVerified = email_verified_status
+    portalService = pp_status
+    secondChanceService = sc_status
+    Scenario = scenario
+
+    def fields(self):
+        return tuple([getattr(self, name) for name in PLAYER_FIELDS[:-1]])
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, PlayerView) and other.batch is self.batch and other.index == self.index:
+            return self.statuses() == other.statuses()
+        try:
+            return self.fields() == tuple([getattr(other, name) for name in PLAYER_FIELDS[:-1]])
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        batch = self.batch
+        index = self.index
+        return PLAYER_FORMAT % ((self._scenario(), batch.contract_identities[index], batch.contract_ids[index]) +
+                                tuple(self.statuses()) + (batch.account_emails[index],))
+
+class FixedPlayerView(PlayerView):
+    """
+    Read-only synced view of one PlayerBatch row: the target statuses come from the batch's
+    classification, everything else from the exported columns.
+    """
+    __slots__ = ()
+
+    def statuses(self):
+        return scenarios.TARGET_STATES[scenarios.TARGETS[self.batch.targets[self.index]]]
+
+class PlayerBatch(object):
+    """
+    Columnar batch of exported players: array-backed contract ids and small-int status columns,
+    interned emails. classify() runs the scenario table over all rows at once.
+    """
+    __slots__ = ('contract_identities', 'account_emails', 'contract_ids', 'email_verified', 'pp_status',
+                 'sc_status', 'last_updated', 'scenarios', 'targets')
+
+    def __init__(self):
+        self.contract_identities = []
+        self.account_emails = []
+        self.contract_ids = array('l')
+        self.email_verified = array('B')
+        self.pp_status = array('B')
+        self.sc_status = array('B')
+        self.last_updated = []
+        self.scenarios = None
+        self.targets = None
+
+    def __len__(self):
+        return len(self.contract_ids)
+
+    def append(self, contract_identity, account_email, contract_id, email_verified, pp_status, sc_status,
+               last_updated=None):
+        self.contract_identities.append(contract_identity)
+        self.account_emails.append(intern(account_email))
+        self.contract_ids.append(int(contract_id))
+        self.email_verified.append(_small_int(email_verified, UNKNOWN_EMAIL_VERIFIED))
+        self.pp_status.append(_small_int(pp_status))
+        self.sc_status.append(_small_int(sc_status))
+        self.last_updated.append(last_updated)
+
+    def append_row(self, row):
+        self.append(*row)
+
+    def classify(self):
+        (self.scenarios, self.targets) = scenarios.classify_batch(self.email_verified, self.pp_status, self.sc_status)
+        for index in range(len(self)):
+            if self.account_emails[index].count(scenarios.INTERNAL_EMAIL_DOMAIN):
+                self.scenarios[index] = 0
+                self.targets[index] = 0
+
+    def fixed_player(self, index):
+        """
+        Return a FixedPlayerView if the row needs syncing, else None.
+        """
+        if self.targets[index]:
+            return FixedPlayerView(self, index)
+        return None
+
+    def rows(self):
+        """
+        Yield (player, fixed_player) PlayerView pairs per row; fixed_player is the player itself
+        when nothing changes.
+        """
+        for index in range(len(self)):
+            player = PlayerView(self, index)
+            yield (player, self.fixed_player(index) or player)
+
+def _small_int(status, unknown=0):
+    """
+    Return status as a small int, or unknown if it is not a number or out of array('B') range.
+    No scenario matches unknown: 0 for a service status, UNKNOWN_EMAIL_VERIFIED for emailVerified.
+    """
+    try:
+        status = int(status)
+    except ValueError:
+        return unknown
+    if not 0 <= status <= SMALL_INT_MAX:
+        return unknown
+    return status
 
 def try_player():
     format = '%s, %s, %s, %s, %s, %s, %s'
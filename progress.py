@@ -0,0 +1,68 @@
+"""
+  Summarized progress: instead of a log line per player, a progress line every N players or
+  T seconds with the throughput and the count of each action, and a compact per-player audit
+  file written in buffered bulk.
+"""
+import time
+
+DEFAULT_PROGRESS_ROWS = 10000
+DEFAULT_PROGRESS_SECONDS = 10
+AUDIT_BUFFER_ROWS = 1000
+
+class Progress(object):
+    def __init__(self, logger, every_rows=DEFAULT_PROGRESS_ROWS, every_seconds=DEFAULT_PROGRESS_SECONDS):
+        self.logger = logger
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.restart()
+
+    def restart(self):
+        self.started = time.time()
+        self.reported = 0
+        self.actions = {}
+        self.next_rows = self.every_rows
+        self.next_time = self.started + self.every_seconds
+
+    def update(self, action_str):
+        self.reported += 1
+        self.actions[action_str] = self.actions.get(action_str, 0) + 1
+
+        if self.reported >= self.next_rows or (self.reported % 100 == 0 and time.time() >= self.next_time):
+            self.log('Progress')
+
+    def log(self, heading):
+        now = time.time()
+        elapsed = now - self.started
+        rate = elapsed and self.reported / elapsed or 0.0
+        actions = ', '.join(['%s %d' % (action_str, count) for (action_str, count) in sorted(self.actions.items())])
+        self.logger.info('%s: %d players, %.0f players/s%s' % (heading, self.reported, rate, actions and ', ' + actions))
+
+        self.next_rows = self.reported + self.every_rows
+        self.next_time = now + self.every_seconds
+
+    def finish(self):
+        self.log('Done')
+
+class AuditFile(object):
+    """
+    One 'processed_count,action,player' line per reported player, written AUDIT_BUFFER_ROWS at a time.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.fout = open(filename, 'w')
+        self.lines = []
+
+    def write(self, processed_count, action_str, fixed_player):
+        self.lines.append('%s,%s,%s\n' % (processed_count, action_str, fixed_player))
+        if len(self.lines) >= AUDIT_BUFFER_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.fout.write(''.join(self.lines))
+        self.lines = []
+
+    def close(self):
+        if self.fout:
+            self.flush()
+            self.fout.close()
+            self.fout = None
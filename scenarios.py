@@ -0,0 +1,104 @@
+"""
+  Out-of-sync PD player account scenarios, as a lookup table.
+
+  Each rule maps the exported (emailVerified, portalService, secondChanceService) statuses to a
+  scenario number and the target the account is synced to, or None if it is left as is.
+  See persist-scenarios/scenario-N.sql for how each broken state is set up.
+"""
+
+NOT_VERIFIED = 0
+VERIFIED = 1
+
+PREACTIVE = 1
+ACTIVE = 2
+SUSPENDED = 3
+
+PREACTIVATE = 'preactivate'
+ACTIVATE = 'activate'
+SUSPEND = 'suspend'
+
+INTERNAL_EMAIL_DOMAIN = '@calottery.com'
+
+# (emailVerified, portalService, secondChanceService) an account is synced to, per target.
+TARGET_STATES = {
+    PREACTIVATE: (NOT_VERIFIED, PREACTIVE, PREACTIVE),
+    ACTIVATE: (VERIFIED, ACTIVE, ACTIVE),
+    SUSPEND: (VERIFIED, SUSPENDED, SUSPENDED)
+}
+
+# (emailVerified, portalService, secondChanceService): (scenario, target)
+SCENARIOS = {
+    (VERIFIED, PREACTIVE, PREACTIVE): (1, SUSPEND),
+    (VERIFIED, PREACTIVE, ACTIVE): (2, ACTIVATE),
+    (NOT_VERIFIED, SUSPENDED, PREACTIVE): (3, PREACTIVATE),
+    (VERIFIED, ACTIVE, PREACTIVE): (4, ACTIVATE),
+    (VERIFIED, SUSPENDED, PREACTIVE): (5, SUSPEND),
+    (VERIFIED, PREACTIVE, SUSPENDED): (6, SUSPEND),
+    (VERIFIED, ACTIVE, SUSPENDED): (7, SUSPEND),
+    (VERIFIED, SUSPENDED, ACTIVE): (8, SUSPEND),
+    (NOT_VERIFIED, ACTIVE, ACTIVE): (9, PREACTIVATE),
+    (VERIFIED, SUSPENDED, SUSPENDED): (10, None),
+    (NOT_VERIFIED, SUSPENDED, SUSPENDED): (11, None)
+}
+
+# Batch API target codes: index into TARGETS, 0 = no change.
+TARGETS = [None, PREACTIVATE, ACTIVATE, SUSPEND]
+
+# Smaller batches are classified in pure Python; NumPy, if installed, is only imported for larger ones.
+NUMPY_MIN_ROWS = 1000
+
+# Statuses pack into one small int key: emailVerified << 6 | portalService << 3 | secondChanceService.
+_STATUS_BITS = 3
+_STATUS_LIMIT = 1 << _STATUS_BITS
+_LUT_SIZE = 2 << (2 * _STATUS_BITS)
+
+def _build_lookup_tables():
+    scenario_lut = [0] * _LUT_SIZE
+    target_lut = [0] * _LUT_SIZE
+    for ((email_verified, pp_status, sc_status), (scenario, target)) in SCENARIOS.items():
+        key = pack_key(email_verified, pp_status, sc_status)
+        scenario_lut[key] = scenario
+        target_lut[key] = TARGETS.index(target)
+    return (scenario_lut, target_lut)
+
+def pack_key(email_verified, pp_status, sc_status):
+    if not (0 <= email_verified <= 1 and 0 <= pp_status < _STATUS_LIMIT and 0 <= sc_status < _STATUS_LIMIT):
+        return 0  # Slot 0 is (0, 0, 0): no scenario.
+    return (email_verified << (2 * _STATUS_BITS)) | (pp_status << _STATUS_BITS) | sc_status
+
+(_SCENARIO_LUT, _TARGET_LUT) = _build_lookup_tables()
+_numpy_luts = []
+
+def _load_numpy():
+    """
+    Import NumPy on first use. Returns (numpy, scenario LUT, target LUT), or None if not installed.
+    """
+    if not _numpy_luts:
+        try:
+            import numpy
+            _numpy_luts.append((numpy, numpy.array(_SCENARIO_LUT, dtype=numpy.uint8),
+                                numpy.array(_TARGET_LUT, dtype=numpy.uint8)))
+        except ImportError:
+            _numpy_luts.append(None)
+    return _numpy_luts[0]
+
+def classify_batch(email_verified, pp_status, sc_status):
+    """
+    Classify whole status columns at once. Returns (scenarios, target codes), indexes into TARGETS.
+    NumPy uint8 arrays when NumPy is installed and the batch has NUMPY_MIN_ROWS, lists otherwise.
+    """
+    numpy_luts = len(email_verified) >= NUMPY_MIN_ROWS and _load_numpy()
+    if numpy_luts:
+        (numpy, scenario_lut, target_lut) = numpy_luts
+        email_verified = numpy.asarray(email_verified, dtype=numpy.int64)
+        pp_status = numpy.asarray(pp_status, dtype=numpy.int64)
+        sc_status = numpy.asarray(sc_status, dtype=numpy.int64)
+        keys = (email_verified << (2 * _STATUS_BITS)) | (pp_status << _STATUS_BITS) | sc_status
+        in_range = ((email_verified >= 0) & (email_verified <= 1) &
+                    (pp_status >= 0) & (pp_status < _STATUS_LIMIT) &
+                    (sc_status >= 0) & (sc_status < _STATUS_LIMIT))
+        keys = numpy.where(in_range, keys, 0)
+        return (scenario_lut[keys], target_lut[keys])
+
+    keys = [pack_key(ev, pp, sc) for (ev, pp, sc) in zip(email_verified, pp_status, sc_status)]
+    return ([_SCENARIO_LUT[key] for key in keys], [_TARGET_LUT[key] for key in keys])
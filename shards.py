@@ -0,0 +1,99 @@
+"""
+  Sharded export: the export query split into N contract_id shards, mod(contract_id, N) = k, each
+  exported concurrently through its own DB session, then merged back into one DEL stream in
+  account_email order, as a single export would have returned it.
+"""
+import csv
+import heapq
+import os
+import re
+import threading
+
+from backend import split_export_sql_stmt
+from extract import read_extract
+from player import ACCOUNT_EMAIL_COL
+
+# Shard predicate goes next to the contact type filter both export queries have.
+SHARD_ANCHOR_RE = re.compile(r'\bcc\.contact_type_id\s*=\s*1\b', re.IGNORECASE)
+EXPORT_TO_RE = re.compile(r'(export\s+to\s+)(\S+)(\s+of\s+del\s)', re.IGNORECASE)
+
+def shard_sql_stmt(sql_stmt, shards, shard, export_filename):
+    """
+    Return the export statement for one shard, exporting to export_filename.
+    """
+    if len(SHARD_ANCHOR_RE.findall(sql_stmt)) != 1:
+        raise Exception('Export SQL has no single "cc.contact_type_id = 1" filter to shard')
+
+    predicate = 'cc.contact_type_id = 1 and mod(cc.contract_id, %d) = %d' % (shards, shard)
+    sql_stmt = SHARD_ANCHOR_RE.sub(predicate, sql_stmt)
+    return EXPORT_TO_RE.sub(lambda match: match.group(1) + export_filename + match.group(3), sql_stmt, 1)
+
+class ShardExport(threading.Thread):
+    """
+    Export one shard to its own DEL file through the thread's own DB session.
+    """
+    def __init__(self, backend, sql_stmt, params):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.backend = backend
+        self.sql_stmt = sql_stmt
+        self.params = params
+        self.error = None
+
+    def run(self):
+        worker_backend = None
+        try:
+            worker_backend = self.backend.open_worker()
+            for csv_line in worker_backend.export(self.sql_stmt, self.params):
+                pass  # The backend writes the shard DEL file.
+        except Exception as error:
+            self.error = str(error)
+
+        if worker_backend:
+            worker_backend.close()
+
+def keyed_lines(shard, filename):
+    """
+    Yield (account_email, shard, csv_line) for heapq.merge; the shard breaks ties stably.
+    """
+    for csv_line in read_extract(filename):
+        fields = next(csv.reader([csv_line]))
+        yield (fields[ACCOUNT_EMAIL_COL], shard, csv_line)
+
+def merge_shard_extracts(filenames, export_filename):
+    """
+    Yield the lines of the account_email ordered shard DEL files, merged in order, writing them to
+    export_filename as they go. The shard files are removed after the merge.
+    """
+    fout = open(export_filename, 'w')
+    keyed = [keyed_lines(shard, filename) for (shard, filename) in enumerate(filenames)]
+    for (account_email, shard, csv_line) in heapq.merge(*keyed):
+        fout.write(csv_line)
+        yield csv_line
+    fout.close()
+
+    for filename in filenames:
+        os.remove(filename)
+
+def export_shards(backend, sql_stmt, params, shards):
+    """
+    Run the shard exports concurrently and wait for them all. Returns an iterator over the merged
+    DEL lines, see merge_shard_extracts. Raise exception if any shard failed.
+    """
+    (export_filename, select_stmt) = split_export_sql_stmt(sql_stmt)
+    filenames = [export_filename + '.shard' + str(shard) for shard in range(shards)]
+
+    exports = []
+    for (shard, filename) in enumerate(filenames):
+        exports.append(ShardExport(backend, shard_sql_stmt(sql_stmt, shards, shard, filename), params))
+    for shard_export in exports:
+        shard_export.start()
+    for shard_export in exports:
+        shard_export.join()
+
+    errors = ['Shard ' + str(shard) + ' export failed: ' + shard_export.error
+              for (shard, shard_export) in enumerate(exports) if shard_export.error]
+    if errors:
+        raise Exception(errors[0])
+
+    return merge_shard_extracts(filenames, export_filename)
@@ -0,0 +1,92 @@
+"""
+  Compiled update SQL template (sync-pd-player-services.sqlt).
+
+  The template's placeholder names are matched as whole words, once, when it is loaded. Rendering a
+  player is then a single % format, and the DB-API backends get the same statements with qmark
+  bind parameters. Templates are cached per filename for the whole run.
+"""
+import re
+
+# SQLT placeholder: Player attribute holding its value.
+SQLT_PLACEHOLDERS = [
+    ('ContractId', 'contractId'),
+    ('EmailVerifiedStatus', 'emailVerified'),
+    ('PP_ServiceStatusId', 'portalService')
+]
+PLACEHOLDER_RE = re.compile(r'\b(' + '|'.join([name for (name, attr) in SQLT_PLACEHOLDERS]) + r')\b')
+
+_templates = {}
+
+def read_file(filename):
+    fin = open(filename, 'r')
+    s = fin.read()
+    fin.close()
+    return s
+
+def split_sql_stmts(sql):
+    """
+    Split a CLP script into statements, dropping -- comments, blank statements and commits.
+    """
+    lines = []
+    for line in sql.splitlines():
+        if not line.strip().startswith('--'):
+            lines.append(line)
+
+    sql_stmts = []
+    for sql_stmt in '\n'.join(lines).split(';'):
+        sql_stmt = sql_stmt.strip()
+        if sql_stmt and sql_stmt.lower() != 'commit':
+            sql_stmts.append(sql_stmt)
+
+    return sql_stmts
+
+def compile_format(sql):
+    """
+    Return (% format string, [player attribute, ...]) with one %s per placeholder, in order.
+    """
+    attrs_by_name = dict(SQLT_PLACEHOLDERS)
+    attrs = [attrs_by_name[name] for name in PLACEHOLDER_RE.findall(sql)]
+    return (PLACEHOLDER_RE.sub('%s', sql.replace('%', '%%')), attrs)
+
+class SqlTemplate(object):
+    def __init__(self, sqlt):
+        self.sqlt = sqlt
+        (self.format, self.attrs) = compile_format(sqlt)
+
+        # The same statements without their commit, for rendering many players into one transaction.
+        batch_lines = [line for line in sqlt.splitlines() if line.strip().lower() != 'commit;']
+        (self.batch_format, self.batch_attrs) = compile_format('\n'.join(batch_lines) + '\n')
+
+        self.parameterized = []
+        for sql_stmt in split_sql_stmts(sqlt):
+            attrs = compile_format(sql_stmt)[1]
+            self.parameterized.append((PLACEHOLDER_RE.sub('?', sql_stmt), attrs))
+
+    def render(self, player):
+        return self.format % tuple([getattr(player, attr) for attr in self.attrs])
+
+    def render_batch(self, players):
+        """
+        Render every player's statements followed by a single commit.
+        """
+        batch_format = self.batch_format
+        batch_attrs = self.batch_attrs
+        sql_stmts = [batch_format % tuple([getattr(player, attr) for attr in batch_attrs]) for player in players]
+        sql_stmts.append('commit;\n')
+        return ''.join(sql_stmts)
+
+    def params(self, attrs, players):
+        """
+        Integer bind parameter rows, for executemany of one parameterized statement.
+        """
+        return [tuple([int(getattr(player, attr)) for attr in attrs]) for player in players]
+
+def load_sql_template(filename):
+    """
+    Load and compile filename once; later calls return the cached SqlTemplate.
+    """
+    template = _templates.get(filename)
+    if template is None:
+        template = SqlTemplate(read_file(filename))
+        _templates[filename] = template
+    return template
@@ -7,50 +7,111 @@
   Author: Pete Jansz
 
 """
-import copy
-import csv
-import datetime
-import glob
-import io
-import json
 import logging
-import logging.config
 import os.path
-import pprint
 import re
 import shutil
-import string
-import subprocess
+import signal
 import sys
+import threading
+import time
 from datetime import date
-from player import Player
-from os import chdir
-from subprocess import Popen, PIPE
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from backend import BACKEND_CHOICES, create_backend
+from exportsql import generate_export_sql
+from extract import compress_extract, iter_batches, read_extract
+from asynclog import start_async_logging
+from hwm import HighWaterMark
+from metrics import Metrics
+from progress import DEFAULT_PROGRESS_ROWS, DEFAULT_PROGRESS_SECONDS, AuditFile, Progress
+from shards import export_shards
+from checkpoint import Checkpoint
+from plan import PlanWriter, read_plan
+from synccache import SyncCache
+from sqltemplate import load_sql_template, read_file
 from optparse import OptionParser
 
 SCRIPT_NAME = 'sync-pd-services'
 DEFAULT_EXTRACTS_DIR = os.path.join('/files/db2/scripts/', SCRIPT_NAME)
 DEFAULT_EXPORT_DEL_SQL_FILENAME = 'export-sync-pd-services.sql'
+DEFAULT_EXPORT_FIXES_SQLT_FILENAME = 'export-fixes-sync-pd-services.sqlt'
 DEFAULT_EXPORT_DEL_CSV_FILENAME = SCRIPT_NAME + '.csv'
 DEFAULT_UPDATE_PLAYER_SQLT_FILENAME = 'sync-pd-player-services.sqlt'
+DEFAULT_MERGE_SQL_FILENAME = 'merge-sync-pd-services.sql'
 DEFAULT_LOG_DIR = os.path.join('/db2dumps/output_logs/', SCRIPT_NAME)
 DEFAULT_DAYS_BACK = -1
 DEFAULT_DBNAME = 'PDDB'
 DEFAULT_DB2OPTS = '-cmstx +p'
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BACKEND = 'clp'
+CLASSIFY_BATCH_ROWS = 10000
+DEFAULT_WORKERS = 1
+DEFAULT_SHARDS = 1
+DEFAULT_INTERVAL = 300
+# Files kept in the log directory, --log_dir:
+STATE_FILENAME = SCRIPT_NAME + '.hwm'
+FIND_STATE_FILENAME = SCRIPT_NAME + '.find.hwm'
+JOURNAL_FILENAME = SCRIPT_NAME + '.journal'
+REJECTS_FILENAME = SCRIPT_NAME + '.rejects'
+AUDIT_FILENAME = SCRIPT_NAME + '.audit'
+METRICS_JSON_FILENAME = SCRIPT_NAME + '.metrics.json'
+METRICS_PROM_FILENAME = SCRIPT_NAME + '.prom'
+HISTORY_JSON_FILENAME = SCRIPT_NAME + '.history.json'
+SYNC_CACHE_FILENAME = SCRIPT_NAME + '.synced.sqlite'
+DEFAULT_STATE_FILENAME = os.path.join(DEFAULT_LOG_DIR, STATE_FILENAME)
+DEFAULT_JOURNAL_FILENAME = os.path.join(DEFAULT_LOG_DIR, JOURNAL_FILENAME)
+DEFAULT_REJECTS_FILENAME = os.path.join(DEFAULT_LOG_DIR, REJECTS_FILENAME)
+DEFAULT_AUDIT_FILENAME = os.path.join(DEFAULT_LOG_DIR, AUDIT_FILENAME)
+DEFAULT_SYNC_CACHE_FILENAME = os.path.join(DEFAULT_LOG_DIR, SYNC_CACHE_FILENAME)
+DEFAULT_SYNC_CACHE_TTL = 24
+DEFAULT_PLAN_MAX_AGE = 24
+METRICS_PREFIX = 'sync_pd_services'
+EXPORT_WINDOW_START = 'current date -1 day'
+EXPORT_WINDOW_START_RE = re.compile(r'between\s+' + EXPORT_WINDOW_START + r'\s+and', re.IGNORECASE)
+WORKER_QUEUED_BATCHES = 2
 LOGGER_NAME = SCRIPT_NAME
 
 logger = None
+progress = None
+audit = None
+sync_cache = None
 parser = OptionParser()
+metrics = Metrics(METRICS_PREFIX)
 
 def parse_cli_args():
     description = 'Find, fix (sync) out-of-sync, PD player accounts\n'
     help_path = 'Working directory path (default=' + DEFAULT_EXTRACTS_DIR + ')'
     help_export_sql = 'Export SQL filename (default=' + DEFAULT_EXPORT_DEL_SQL_FILENAME + ')'
+    help_export_sqlt = 'Prefilter export SQLT filename (default=' + DEFAULT_EXPORT_FIXES_SQLT_FILENAME + ')'
     help_csv = 'Input del csv filename (default=' + DEFAULT_EXPORT_DEL_CSV_FILENAME + ')'
     help_update_sqlt = 'Update player services SQLT filename (default=' + DEFAULT_UPDATE_PLAYER_SQLT_FILENAME + ')'
+    help_merge_sql = 'Set-based merge SQL filename (default=' + DEFAULT_MERGE_SQL_FILENAME + ')'
+    help_log_dir = 'Log, state and metrics directory (default=' + DEFAULT_LOG_DIR + ')'
+    help_history = ('With --nodb, analyze the archived extracts matching GLOB, relative to the log directory, '
+                    'e.g. "' + DEFAULT_EXPORT_DEL_CSV_FILENAME + '.2026-*"')
     help_dbname = 'DB name (default=' + DEFAULT_DBNAME + ')'
+    help_workers = 'Parallel sync workers, fixes partitioned by contract_id (default=' + str(DEFAULT_WORKERS) + ')'
+    help_shards = 'Concurrent export sessions, rows sharded by contract_id (default=' + str(DEFAULT_SHARDS) + ')'
+    help_progress_rows = 'With --progress, log progress every N players (default=' + str(DEFAULT_PROGRESS_ROWS) + ')'
+    help_progress_seconds = 'With --progress, log progress every N seconds (default=' + str(DEFAULT_PROGRESS_SECONDS) + ')'
+    help_audit_file = 'With --progress, per-player audit file (default=' + DEFAULT_AUDIT_FILENAME + ')'
+    help_plan = 'With --find or --nodb, also write the fixes to sync to FILE, JSON Lines (gzipped if FILE ends in .gz)'
+    help_apply_plan = 'Sync the fixes of a reviewed --plan FILE, without a new export'
+    help_plan_max_age = 'With --apply_plan, refuse a plan older than HOURS, 0 for any age (default=' + str(DEFAULT_PLAN_MAX_AGE) + ')'
+    help_interval = 'With --daemon, seconds from the start of one cycle to the next (default=' + str(DEFAULT_INTERVAL) + ')'
+    help_state_file = ('Incremental high-water mark state file (default=' + DEFAULT_STATE_FILENAME +
+                       ', with --daemon --find ' + FIND_STATE_FILENAME + ' in the log directory)')
+    help_journal_file = 'Sync checkpoint journal file (default=' + DEFAULT_JOURNAL_FILENAME + ')'
+    help_sync_cache_file = 'With --track_synced, synced contracts cache file (default=' + DEFAULT_SYNC_CACHE_FILENAME + ')'
+    help_sync_cache_ttl = 'With --track_synced, hours a synced contract is remembered (default=' + str(DEFAULT_SYNC_CACHE_TTL) + ')'
+    help_rejects_file = 'Rejected players file (default=' + DEFAULT_REJECTS_FILENAME + ')'
+    help_backend = 'Database backend, ' + '|'.join(BACKEND_CHOICES) + ' (default=' + DEFAULT_BACKEND + ')'
     help_db2opts = 'DB2 opts (default=' + DEFAULT_DB2OPTS + ')'
     help_days_back = 'Find player accounts where changed days back (default=' + str(DEFAULT_DAYS_BACK) + ')'
+    help_batch_size = 'Sync players per DB2 CLP session and commit (default=' + str(DEFAULT_BATCH_SIZE) + ')'
 
     SUBDEBUG = int(logging.DEBUG / 2)
     VERBOSE = logging.INFO - 5
@@ -66,16 +127,52 @@ def parse_cli_args():
                       dest='path', help=help_path, default=DEFAULT_EXTRACTS_DIR, metavar='FILE')
     parser.add_option('--export_sql', action='store', type='str',
                       dest='export_sql', help=help_export_sql, default=DEFAULT_EXPORT_DEL_SQL_FILENAME, metavar='FILE')
+    parser.add_option('--export_sqlt', action='store', type='str',
+                      dest='export_sqlt', help=help_export_sqlt, default=DEFAULT_EXPORT_FIXES_SQLT_FILENAME, metavar='FILE')
+    parser.add_option('--prefilter', action='store_true',
+                      help='Export only the accounts that need a fix, classified by the database', dest='prefilter',
+                      default=False)
     parser.add_option('--csvfile', action='store', help=help_csv, default=DEFAULT_EXPORT_DEL_CSV_FILENAME,
                       type='str', dest='csvfile', metavar='FILE')
     parser.add_option('--update_sqlt', action='store', help=help_update_sqlt, default=DEFAULT_UPDATE_PLAYER_SQLT_FILENAME,
                       type='str', dest='update_sqlt', metavar='FILE')
+    parser.add_option('--merge_sql', action='store', help=help_merge_sql, default=DEFAULT_MERGE_SQL_FILENAME,
+                      type='str', dest='merge_sql', metavar='FILE')
+    parser.add_option('--merge', action='store_true',
+                      help='With --sync, stage all fixes in a temporary table and apply them set-based', dest='merge', default=False)
     parser.add_option('--nodb', action='store_true',
                       help='No db2 access. Read csvfile and report proposed synced changes', dest='nodb', default=False)
+    parser.add_option('--history', action='store', type='str',
+                      dest='history', help=help_history, default=None, metavar='GLOB')
+    parser.add_option('--since', action='store', type='str',
+                      help='With --history, from archive date YYYY-MM-DD', dest='since', default=None, metavar='DATE')
+    parser.add_option('--until', action='store', type='str',
+                      help='With --history, to archive date YYYY-MM-DD', dest='until', default=None, metavar='DATE')
+    parser.add_option('--processes', action='store', type='int',
+                      help='With --history, analysis processes (default=CPU count)', dest='processes', default=0)
+    parser.add_option('--compress_archive', action='store_true',
+                      help='Archive the previous csvfile gzip-compressed', dest='compress_archive', default=False)
     parser.add_option('--find', action='store_true',
                       help='Only find, export to the csvfile, report proposed changes, do not update players', dest='find', default=False)
     parser.add_option('--sync', action='store_true',
                       help='Find, update/sync player accounts', dest='sync', default=False)
+    parser.add_option('--plan', action='store', type='str',
+                      dest='plan', help=help_plan, default=None, metavar='FILE')
+    parser.add_option('--apply_plan', action='store', type='str',
+                      dest='apply_plan', help=help_apply_plan, default=None, metavar='FILE')
+    parser.add_option('--plan_max_age', action='store', type='float',
+                      dest='plan_max_age', help=help_plan_max_age, default=DEFAULT_PLAN_MAX_AGE, metavar='HOURS')
+    parser.add_option('--progress', action='store_true',
+                      help='Log summarized progress instead of every player; players go to the audit file',
+                      dest='progress', default=False)
+    parser.add_option('--progress_rows', action='store', type='int',
+                      dest='progress_rows', help=help_progress_rows, default=DEFAULT_PROGRESS_ROWS)
+    parser.add_option('--progress_seconds', action='store', type='int',
+                      dest='progress_seconds', help=help_progress_seconds, default=DEFAULT_PROGRESS_SECONDS)
+    parser.add_option('--audit_file', action='store', type='str',
+                      dest='audit_file', help=help_audit_file, default=None, metavar='FILE')
+    parser.add_option('--log_dir', action='store', type='str',
+                      dest='log_dir', help=help_log_dir, default=DEFAULT_LOG_DIR, metavar='DIR')
     parser.add_option('--log_level', action='store', type=int,
                       help=help_log_level, dest='log_level', default=logging.INFO)
     parser.add_option('--days_back', action='store', type='int',
@@ -84,13 +181,60 @@ def parse_cli_args():
                       dest='dbname', help=help_dbname, default=DEFAULT_DBNAME)
     parser.add_option('--db2opts', action='store', type='str', dest='db2opts',
                       help=help_db2opts, default=DEFAULT_DB2OPTS)
+    parser.add_option('--backend', action='store', type='choice', choices=BACKEND_CHOICES,
+                      dest='backend', help=help_backend, default=DEFAULT_BACKEND)
+    parser.add_option('--incremental', action='store_true',
+                      help='Export only contacts updated after the last synced last_updated, kept in the state file',
+                      dest='incremental', default=False)
+    parser.add_option('--state_file', action='store', type='str',
+                      dest='state_file', help=help_state_file, default=None, metavar='FILE')
+    parser.add_option('--resume', action='store_true',
+                      help='With --sync, continue the last sync of csvfile, skipping journaled players',
+                      dest='resume', default=False)
+    parser.add_option('--journal_file', action='store', type='str',
+                      dest='journal_file', help=help_journal_file, default=None, metavar='FILE')
+    parser.add_option('--rejects_file', action='store', type='str',
+                      dest='rejects_file', help=help_rejects_file, default=None, metavar='FILE')
+    parser.add_option('--track_synced', action='store_true',
+                      help='With --sync, remember the fixes applied, and warn about a fix a recent run '
+                           'already applied that did not stick',
+                      dest='track_synced', default=False)
+    parser.add_option('--sync_cache_file', action='store', type='str',
+                      dest='sync_cache_file', help=help_sync_cache_file, default=None, metavar='FILE')
+    parser.add_option('--sync_cache_ttl', action='store', type='float',
+                      dest='sync_cache_ttl', help=help_sync_cache_ttl, default=DEFAULT_SYNC_CACHE_TTL)
+    parser.add_option('--workers', action='store', type='int',
+                      dest='workers', help=help_workers, default=DEFAULT_WORKERS)
+    parser.add_option('--daemon', action='store_true',
+                      help='Keep running: --find or --sync the changes since the last cycle every --interval, '
+                           'on one warm connection. Implies --incremental', dest='daemon', default=False)
+    parser.add_option('--interval', action='store', type='int',
+                      dest='interval', help=help_interval, default=DEFAULT_INTERVAL)
+    parser.add_option('--shards', action='store', type='int',
+                      dest='shards', help=help_shards, default=DEFAULT_SHARDS)
+    parser.add_option('--batch_size', action='store', type='int',
+                      dest='batch_size', help=help_batch_size, default=DEFAULT_BATCH_SIZE)
 
     return parser.parse_args()
 
+def init_log_dir_files(options):
+    """
+    Files not given on the command line default to the log directory.
+    """
+    options.log_dir = os.path.abspath(options.log_dir)
+    if options.state_file is None and options.daemon and options.find:
+        # A --find daemon advances a mark of its own: the --sync runs' mark must not skip unfixed rows.
+        options.state_file = os.path.join(options.log_dir, FIND_STATE_FILENAME)
+    for (dest, filename) in (('state_file', STATE_FILENAME), ('journal_file', JOURNAL_FILENAME),
+                             ('rejects_file', REJECTS_FILENAME), ('audit_file', AUDIT_FILENAME),
+                             ('sync_cache_file', SYNC_CACHE_FILENAME)):
+        if getattr(options, dest) is None:
+            setattr(options, dest, os.path.join(options.log_dir, filename))
+
 def init_db2_options(options):
 
-    logfile_name = os.path.join(DEFAULT_LOG_DIR, 'sync-pd-services-db2-clp.log.' + date.today().isoformat())
-    historylog_name = os.path.join(DEFAULT_LOG_DIR, 'sync-pd-services-history.log')
+    logfile_name = os.path.join(options.log_dir, 'sync-pd-services-db2-clp.log.' + date.today().isoformat())
+    historylog_name = os.path.join(options.log_dir, 'sync-pd-services-history.log')
 
     if options.db2opts:
         os.environ['DB2OPTIONS'] = options.db2opts
@@ -104,175 +248,479 @@ def init_db2_options(options):
 
     return (logfile_name, historylog_name)
 
-def convert_popen_strs_to_str(strs):
-    msg = ' '.join(strs.split('\\r'))
-    return msg.replace('\r', '').replace('\n', '')
-
-def run_export_sync_pd_services(options, logfile_name, historylog_name):
+def run_export_sync_pd_services(options, backend, high_water_mark=None):
     logger.debug('Preaparing run_export_sync_pd_services ...')
 
     # Archive an existing CSV file?
     default_export_filename = os.path.join(options.path, DEFAULT_EXPORT_DEL_CSV_FILENAME)
     if os.path.exists(default_export_filename):
         date_filename = DEFAULT_EXPORT_DEL_CSV_FILENAME + '.' + date.today().isoformat()
-        archive_export_filename = os.path.join(DEFAULT_LOG_DIR, date_filename)
-        logger.debug('Archiving: ' + archive_export_filename)
-        shutil.move(default_export_filename, archive_export_filename)
-
-    connect_session = Popen(['db2', ('connect to ' + options.dbname)], stdout=PIPE, stderr=PIPE)
-    if connect_session.wait():
-        stdoutStrings, stderrStrings = connect_session.communicate()
-        msg = convert_popen_strs_to_str(stdoutStrings)
+        if options.daemon:
+            # A cycle's extract per archive, not just the day's last.
+            date_filename += '.' + time.strftime('%H%M%S')
+        archive_export_filename = os.path.join(options.log_dir, date_filename)
+        if options.compress_archive:
+            archive_export_filename += '.gz'
+            logger.debug('Archiving: ' + archive_export_filename)
+            compress_extract(default_export_filename, archive_export_filename)
+        else:
+            logger.debug('Archiving: ' + archive_export_filename)
+            shutil.move(default_export_filename, archive_export_filename)
+
+    if options.prefilter:
+        sql_stmt = generate_export_sql(read_file(options.export_sqlt))
+        logger.verbose('Exporting only out-of-sync players')
+    else:
+        sql_stmt = read_file(options.export_sql)
+    params = ()
+
+    if high_water_mark and high_water_mark.load():
+        if not EXPORT_WINDOW_START_RE.search(sql_stmt):
+            raise Exception('Export SQL has no "' + EXPORT_WINDOW_START + '" window to make incremental')
+        sql_stmt = EXPORT_WINDOW_START_RE.sub('> ? and cc.last_updated <=', sql_stmt)
+        params = (high_water_mark.mark,)
+        logger.verbose('Querying last_updated after ' + high_water_mark.mark)
+    else:
+        if options.days_back != DEFAULT_DAYS_BACK:
+            sql_stmt = sql_stmt.replace(
+                'current date -1 day', 'current date ' + str(options.days_back) + ' day')
+        logger.verbose('Querying current date ' + str(options.days_back) + ' day')
+
+    with metrics.timed('export'):
+        if options.shards > 1:
+            logger.verbose('Exporting ' + str(options.shards) + ' contract_id shards concurrently')
+            csv_lines = export_shards(backend, sql_stmt, params, options.shards)
+        else:
+            # Parallel workers commit through sessions of their own: spool the whole export first.
+            spool = options.sync and options.workers > 1 and not options.merge
+            csv_lines = backend.export(sql_stmt, params, spool)
+    if high_water_mark:
+        csv_lines = high_water_mark.observe_lines(csv_lines)
+    return csv_lines
+
+def run_sync_batch(options, backend, batch_number, fixed_players):
+    """
+    Apply a batch of player updates in one transaction.
+    Raise exception, after the backend rolled back the batch, on error.
+    """
+    logger.debug('Syncing batch ' + str(batch_number) + ', ' + str(len(fixed_players)) + ' players ...')
+
+    start = time.time()
+    try:
+        backend.sync_batch(fixed_players, load_sql_template(options.update_sqlt))
+        metrics.observe('sync_batch_seconds', time.time() - start)
+    except Exception as error:
+        metrics.observe('failed_batch_seconds', time.time() - start)
+        msg = 'Batch ' + str(batch_number) + ' failed, rolled back: ' + str(error)
+        logger.error(msg)
         raise Exception(msg)
 
-    logger.debug('run_export_sync_pd_services connected to ' + options.dbname)
+def apply_batch(options, backend, checkpoint, batch_number, batch):
+    """
+    Apply and journal a batch of (processed_count, fixed_player). If the batch fails, retry its
+    players one at a time so a bad row is quarantined in the rejects file instead of aborting the run.
+    Returns (synced, rejected) lists of (processed_count, fixed_player).
+    """
+    try:
+        run_sync_batch(options, backend, batch_number, [fixed_player for (count, fixed_player) in batch])
+        checkpoint.commit(batch_number, [fixed_player for (count, fixed_player) in batch])
+        return (batch, [])
+    except Exception as error:
+        if len(batch) == 1:
+            checkpoint.reject(batch_number, batch[0][1], error)
+            return ([], batch)
+
+    synced = []
+    rejected = []
+    for (count, fixed_player) in batch:
+        try:
+            run_sync_batch(options, backend, batch_number, [fixed_player])
+            checkpoint.commit(batch_number, [fixed_player])
+            synced.append((count, fixed_player))
+        except Exception as error:
+            checkpoint.reject(batch_number, fixed_player, error)
+            rejected.append((count, fixed_player))
+
+    return (synced, rejected)
+
+def report_batch(batch_number, synced, rejected):
+    if sync_cache and synced:
+        sync_cache.record([fixed_player for (count, fixed_player) in synced])
+    metrics.count('batches')
+    metrics.count('synced', len(synced))
+    metrics.count('rejected', len(rejected))
+    logger.info('Batch ' + str(batch_number) + ': ' + str(len(synced)) + ' players synced' +
+                (rejected and ', ' + str(len(rejected)) + ' rejected' or ''))
+    for (count, fixed_player) in synced:
+        report_player(count, fixed_player, 'synced')
+    for (count, fixed_player) in rejected:
+        report_player(count, fixed_player, 'rejected')
+
+def unsynced_players(players, checkpoint):
+    """
+    Pipeline stage: classify_players (or planned_players), minus the contracts a resumed run already
+    journaled. With --track_synced, a fix a recent run already applied is counted as relapsed and
+    logged, then applied again.
+    """
+    if sync_cache:
+        metrics.count('relapsed', 0)
+    for (processed_count, player, fixed_player) in players:
+        if checkpoint.is_done(player.contractId):
+            report_player(processed_count, fixed_player, 'resumed')
+            continue
+
+        if sync_cache and fixed_player != player and sync_cache.relapsed(fixed_player):
+            metrics.count('relapsed')
+            logger.warning('Fix did not stick, applying it again: ' + str(fixed_player))
+        yield (processed_count, player, fixed_player)
+
+def merge_players(options, backend, checkpoint, players):
+    """
+    Stage every fixed player, then apply them all with the set-based merge SQL in one transaction.
+    """
+    processed_count = 0
+    fixes = []
+    for (processed_count, player, fixed_player) in unsynced_players(players, checkpoint):
+        if fixed_player != player:
+            fixes.append((processed_count, fixed_player))
+        else:
+            report_player(processed_count, fixed_player, 'skipped')
 
-    process_session = Popen(['db2', '-z', logfile_name, '-l', historylog_name], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    logger.verbose('Exported ' + str(processed_count) + ' players')
+    if not fixes:
+        logger.verbose('Nothing to merge')
+        return
 
-    sql_stmt = read_file(options.export_sql)
-    if options.days_back != DEFAULT_DAYS_BACK:
-        sql_stmt = sql_stmt.replace(
-            'current date -1 day', 'current date ' + str(options.days_back) + ' day')
+    fixed_players = [fixed_player for (count, fixed_player) in fixes]
+    logger.debug('Merging ' + str(len(fixed_players)) + ' players ...')
+
+    try:
+        with metrics.timed('merge'):
+            backend.merge(fixed_players, read_file(options.merge_sql))
+    except Exception as error:
+        raise Exception('Merge failed, rolled back: ' + str(error))
 
-    logger.verbose('Querying current date ' + str(options.days_back) + ' day')
-    process_session.stdin.write(sql_stmt)
+    checkpoint.commit(1, fixed_players)
+    metrics.count('synced', len(fixed_players))
+    if sync_cache:
+        sync_cache.record(fixed_players)
+    for (count, fixed_player) in fixes:
+        report_player(count, fixed_player, 'synced')
 
-    stdoutStrings, stderrStrings = process_session.communicate()
-    omsg = convert_popen_strs_to_str(stdoutStrings)
-    emsg = convert_popen_strs_to_str(stderrStrings)
-    if omsg.count('error'):
-        raise Exception(omsg)
-    if emsg.count('error'):
-        raise Exception(emsg)
+    logger.info('Merged ' + str(len(fixed_players)) + ' players')
 
-def check_hadr(options):
+class SyncWorker(threading.Thread):
+    """
+    Apply the batches of one contract_id partition through the worker's own DB session.
+    Every outcome, (batch_number, synced, rejected, session error or None), goes to the results queue.
+    """
+    def __init__(self, options, backend, checkpoint, results):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.options = options
+        self.backend = backend
+        self.checkpoint = checkpoint
+        self.jobs = queue.Queue(WORKER_QUEUED_BATCHES)
+        self.results = results
+
+    def run(self):
+        worker_backend = None
+        session_error = None
+        try:
+            worker_backend = self.backend.open_worker()
+        except Exception as error:
+            session_error = 'No worker session: ' + str(error)
+
+        job = self.jobs.get()
+        while job is not None:
+            (batch_number, batch) = job
+            if session_error:
+                self.results.put((batch_number, [], [], session_error))
+            else:
+                (synced, rejected) = apply_batch(self.options, worker_backend, self.checkpoint, batch_number, batch)
+                self.results.put((batch_number, synced, rejected, None))
+            job = self.jobs.get()
+
+        if worker_backend:
+            worker_backend.close()
+
+def sync_players_parallel(options, backend, checkpoint, players):
     """
-    Raise exception if HADR and role is Standby.
+    Partition the fixes by contract_id over options.workers SyncWorkers, so no two workers touch
+    the same contract. Batches are reported in dispatch order, then one summary.
     """
-    logger.verbose('Checking HADR ...')
-    hadr_enabled = False
-    role_standby = False
-    process_session = Popen(['db2', ('get snapshot for database on ' + options.dbname) ], stdout=PIPE, stderr=PIPE)
-    stdoutStrings, stderrStrings = process_session.communicate()
+    processed_count = 0
+    batch_size = max(options.batch_size, 1)
+    results = queue.Queue()
+    workers = [SyncWorker(options, backend, checkpoint, results) for k in range(options.workers)]
+    for worker in workers:
+        worker.start()
+
+    partitions = [[] for worker in workers]
+    counts = {'dispatched': 0, 'reported': 0, 'synced': 0, 'rejected': 0, 'errors': []}
+    finished = {}
+
+    def report_results(block):
+        while counts['reported'] < counts['dispatched']:
+            try:
+                (batch_number, synced, rejected, error) = results.get(block)
+            except queue.Empty:
+                return
+            finished[batch_number] = (synced, rejected, error)
+
+            while counts['reported'] + 1 in finished:
+                counts['reported'] += 1
+                (synced, rejected, error) = finished.pop(counts['reported'])
+                if error:
+                    counts['errors'].append(error)
+                else:
+                    counts['synced'] += len(synced)
+                    counts['rejected'] += len(rejected)
+                    report_batch(counts['reported'], synced, rejected)
+
+    def dispatch(k):
+        counts['dispatched'] += 1
+        workers[k].jobs.put((counts['dispatched'], partitions[k]))
+        partitions[k] = []
 
-    for line in stdoutStrings.split('\\r'):
-        if line.count('HADR'): hadr_enabled = True
-        if re.search('Role .*= Standby', line): role_standby = True
-        if line.count('SQL1013N'):
-            msg = convert_popen_strs_to_str(line)
-            raise Exception(msg)
+    try:
+        for (processed_count, player, fixed_player) in unsynced_players(players, checkpoint):
+            if counts['errors']:
+                break  # A worker lost its session: stop feeding the workers.
 
-    if hadr_enabled and role_standby:
-        msg = 'HADR Role: Standby'
-        raise Exception(msg)
+            if fixed_player != player:
+                k = int(fixed_player.contractId) % len(workers)
+                partitions[k].append((processed_count, fixed_player))
+                if len(partitions[k]) >= batch_size:
+                    dispatch(k)
+            else:
+                report_player(processed_count, fixed_player, 'skipped')
+
+            report_results(False)
+
+        for k in range(len(workers)):
+            if partitions[k] and not counts['errors']:
+                dispatch(k)
+    finally:
+        # Even if the players or the reporting raised: the workers finish their queued batches, all
+        # journaled before the checkpoint closes, and are reported.
+        for worker in workers:
+            worker.jobs.put(None)
+        for worker in workers:
+            worker.join()
+        report_results(False)
+
+    logger.info('Synced ' + str(counts['synced']) + ' players in ' + str(counts['dispatched']) +
+                ' batches, ' + str(len(workers)) + ' workers, ' + str(counts['rejected']) + ' rejected')
+    if counts['errors']:
+        raise Exception(counts['errors'][0])
+
+class Preflight(threading.Thread):
+    """
+    Check the HADR role through a session of its own, concurrently with the export.
+    """
+    def __init__(self, backend):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.backend = backend
+        self.error = None
+
+    def run(self):
+        worker_backend = None
+        try:
+            with metrics.timed('hadr'):
+                worker_backend = self.backend.open_worker()
+                worker_backend.check_hadr()
+        except Exception as error:
+            self.error = str(error)
+
+        if worker_backend:
+            worker_backend.close()
+
+    def wait(self):
+        """
+        Raise exception if HADR and role is Standby, or the check failed.
+        """
+        self.join()
+        if self.error:
+            raise Exception(self.error)
+
+def sync_players(options, backend, checkpoint, players):
+    if options.workers > 1:
+        return sync_players_parallel(options, backend, checkpoint, players)
 
-def create_sql_stmt(options, player):
-    sqlt = read_file(options.update_sqlt)
-    sql_stmt = sqlt.replace('ContractId', player.contractId).replace('EmailVerifiedStatus', player.emailVerified).replace(
-        'PP_ServiceStatusId', player.portalService)
-    return sql_stmt
-
-def read_file(filename):
-    fin = open(filename, 'r')
-
-    s = ''
-    for line in fin.readlines():
-        s += line
-
-    fin.close()
-
-    return s
-
-def fix_player(player):
-    if player.account_email.count('@calottery.com'):
-        return player
-
-    fixed_player = copy.deepcopy(player)
-
-    NOT_VERIFIED = '0'
-    VERIFIED = '1'
-    PREACTIVE = '1'
-    ACTIVE = '2'
-    SUSPENDED = '3'
-
-    # Scenario # 1
-    if player.emailVerified == VERIFIED and player.portalService == PREACTIVE and player.secondChanceService == PREACTIVE:
-        fixed_player.scenario = 1
-        fixed_player.suspend()
-    # 2
-    elif player.emailVerified == VERIFIED and player.portalService == PREACTIVE and player.secondChanceService == ACTIVE:
-        fixed_player.scenario = 2
-        fixed_player.activate()
-    # 3
-    elif player.emailVerified == NOT_VERIFIED and player.portalService == SUSPENDED and player.secondChanceService == PREACTIVE:
-        fixed_player.scenario = 3
-        fixed_player.preactivate()
-    # 4
-    elif player.emailVerified == VERIFIED and player.portalService == ACTIVE and player.secondChanceService == PREACTIVE:
-        fixed_player.scenario = 4
-        fixed_player.activate()
-    # 5
-    elif player.emailVerified == VERIFIED and player.portalService == SUSPENDED and player.secondChanceService == PREACTIVE:
-        fixed_player.scenario = 5
-        fixed_player.suspend()
-    # 6
-    elif player.emailVerified == VERIFIED and player.portalService == PREACTIVE and player.secondChanceService == SUSPENDED:
-        fixed_player.scenario = 6
-        fixed_player.suspend()
-    # 7
-    elif player.emailVerified == VERIFIED and player.portalService == ACTIVE and player.secondChanceService == SUSPENDED:
-        fixed_player.scenario = 7
-        fixed_player.suspend()
-    # 8
-    elif player.emailVerified == VERIFIED and player.portalService == SUSPENDED and player.secondChanceService == ACTIVE:
-        fixed_player.scenario = 8
-        fixed_player.suspend()
-    # 9
-    elif player.emailVerified == NOT_VERIFIED and player.portalService == ACTIVE and player.secondChanceService == ACTIVE:
-        fixed_player.scenario = 9
-        fixed_player.preactivate()
-    # 10
-    elif player.emailVerified == VERIFIED and player.portalService == SUSPENDED and player.secondChanceService == SUSPENDED:
-        fixed_player.scenario = 10
-    # 11
-    elif player.emailVerified == NOT_VERIFIED and player.portalService == SUSPENDED and player.secondChanceService == SUSPENDED:
-        fixed_player.scenario = 11
-        pass  # fixed_player.suspend()
-
-    return fixed_player
-
-def report_player(processed_count, total_count, fixed_player, action_str):
-    format_str = '%03s/%s %s %s'
+    processed_count = 0
+    batch_size = max(options.batch_size, 1)
+    batch_number = 0
+    batch = []
+    rejected_count = 0
+
+    for (processed_count, player, fixed_player) in unsynced_players(players, checkpoint):
+        if fixed_player != player:
+            batch.append((processed_count, fixed_player))
+            if len(batch) >= batch_size:
+                batch_number += 1
+                (synced, rejected) = apply_batch(options, backend, checkpoint, batch_number, batch)
+                report_batch(batch_number, synced, rejected)
+                rejected_count += len(rejected)
+                batch = []
+        else:
+            report_player(processed_count, fixed_player, 'skipped')
+
+    if batch:
+        batch_number += 1
+        (synced, rejected) = apply_batch(options, backend, checkpoint, batch_number, batch)
+        report_batch(batch_number, synced, rejected)
+        rejected_count += len(rejected)
+
+    logger.verbose('Exported ' + str(processed_count) + ' players')
+    logger.verbose('Synced ' + str(batch_number) + ' batches, ' + str(rejected_count) + ' players rejected')
+
+def classify_players(csv_lines):
+    """
+    Pipeline stage: yield (processed_count, player, fixed_player) for each extract line.
+    Lines are parsed and classified a PlayerBatch of CLASSIFY_BATCH_ROWS at a time.
+    Parse time includes reading the export, which a DB-API backend streams from its cursor.
+    """
+    processed_count = 0
+    batches = iter_batches(csv_lines, CLASSIFY_BATCH_ROWS)
+    while True:
+        start = time.time()
+        try:
+            batch = next(batches)
+        except StopIteration:
+            metrics.add_time('parse', time.time() - start)
+            break
+        metrics.add_time('parse', time.time() - start)
+
+        with metrics.timed('classify'):
+            batch.classify()
+        metrics.count('rows', len(batch))
+        metrics.count_scenarios(batch.scenarios)
+
+        for (player, fixed_player) in batch.rows():
+            processed_count += 1
+            yield (processed_count, player, fixed_player)
+
+def planned_players(filename, max_age):
+    """
+    Pipeline stage: [(processed_count, player, fixed_player), ...] for the fixes of a reviewed plan,
+    no older than max_age hours. The whole plan is read and validated, none of it applies if a line is bad.
+    """
+    fixes = read_plan(filename, max_age * 3600)
+    metrics.count('rows', len(fixes))
+    logger.verbose('Plan: ' + str(len(fixes)) + ' fixes read from ' + filename)
+    return [(index + 1, player, fixed_player) for (index, (player, fixed_player)) in enumerate(fixes)]
+
+def report_player(processed_count, fixed_player, action_str):
+    if progress:
+        audit.write(processed_count, action_str, fixed_player)
+        progress.update(action_str)
+        return
+
+    format_str = '%03s %s %s'
     msg = format_str % (
         str(processed_count),
-        str(total_count),
         action_str,
         fixed_player
     )
 
     logger.info(msg)
 
-def no_db(options):
+def no_db(options, csv_lines):
 
     processed_count = 0
-    total_count = sum(1 for line in open(options.csvfile))
-    csv_file = open(options.csvfile)
+    sync_count = 0
+    plan = None
+    if options.plan:
+        plan = PlanWriter(options.plan)
 
-    for csv_line in csv_file:
-        if csv_line.find('CONTRACT_IDENTITY') >= 0:
-            continue  # Skip column-heading row.
-
-        player = Player(csv_line)
-        fixed_player = fix_player(player)
-
-        processed_count += 1
+    for (processed_count, player, fixed_player) in classify_players(csv_lines):
         action_str = 'skip'
 
         if fixed_player.Scenario and fixed_player.Scenario < 10:
             if player != fixed_player:
                 action_str = 'sync'
+                sync_count += 1
+                if plan:
+                    plan.write(player, fixed_player)
+
+        report_player(processed_count, fixed_player, action_str)
+
+    logger.verbose('Processed ' + str(processed_count) + ' players, ' + str(sync_count) + ' to sync')
+    if plan:
+        logger.verbose('Plan: ' + str(plan.close()) + ' fixes written to ' + options.plan)
+
+def init_progress(options):
+    global progress, audit
+    if options.progress:
+        progress = Progress(logger, max(options.progress_rows, 1), max(options.progress_seconds, 1))
+        audit = AuditFile(options.audit_file)
+        logger.verbose('Audit file: ' + options.audit_file)
+
+def init_sync_cache(options):
+    global sync_cache
+    if options.track_synced:
+        sync_cache = SyncCache(options.sync_cache_file, options.sync_cache_ttl * 3600)
+        logger.verbose('Synced contracts cache: %d contracts, %d expired' % sync_cache.open())
+
+def finish_progress():
+    if progress:
+        progress.finish()
+        audit.close()
+
+def finish_cycle_progress():
+    """
+    Log a daemon cycle's progress and count the next cycle's from zero; the audit file stays open.
+    """
+    if progress:
+        progress.finish()
+        progress.restart()
+        audit.flush()
 
-        report_player(processed_count, total_count, fixed_player, action_str)
+def metrics_filenames(options):
+    """
+    The run's (json, prom) metrics files in the log directory. A --sync run's are METRICS_JSON_FILENAME
+    and METRICS_PROM_FILENAME; another mode's have the mode in their names, e.g. sync-pd-services.find.prom,
+    so an ad-hoc run doesn't overwrite the sync's last run metrics.
+    """
+    filenames = (METRICS_JSON_FILENAME, METRICS_PROM_FILENAME)
+    mode = metrics.labels['mode']
+    if mode != 'sync':
+        filenames = [SCRIPT_NAME + '.' + mode + filename[len(SCRIPT_NAME):] for filename in filenames]
+    return [os.path.join(options.log_dir, filename) for filename in filenames]
+
+def write_metrics(options, success):
+    """
+    Write the run's metrics files. A failure to write them is logged, it does not fail the run.
+    """
+    try:
+        (json_filename, prom_filename) = metrics_filenames(options)
+        summary = metrics.write(json_filename, prom_filename, success)
+    except Exception as error:
+        logger.error('Metrics not written: ' + str(error))
+        return
+
+    for phase in summary['phases']:
+        logger.verbose('Phase %s: %.3f s' % (phase['phase'], phase['seconds']))
+    logger.verbose('Rows: %d, %.0f rows/s' % (summary['counters'].get('rows', 0), summary['rows_per_second']))
+
+def no_db_history(options):
+    """
+    Analyze the archived extracts in parallel and report them together.
+    """
+    # Imported here: multiprocessing is only needed by --history.
+    from history import analyze_history, find_archives, report_history, summarize_history
+
+    pattern = os.path.join(options.log_dir, options.history)
+    filenames = find_archives(pattern, options.since, options.until)
+    if not filenames:
+        raise Exception('No archived extracts match: ' + pattern)
+
+    logger.verbose('Analyzing ' + str(len(filenames)) + ' archived extracts ...')
+    summary = summarize_history(analyze_history(filenames, options.processes))
+    metrics.count('rows', summary['rows'])
+    report_history(logger, summary, os.path.join(options.log_dir, HISTORY_JSON_FILENAME))
 
 def _subdebug(self, message, *args, **kws):
     """
@@ -309,25 +757,141 @@ def init_logger(options):
     consoleHandler_formatter = logging.Formatter(fmt=FORMAT_BASE)
     consoleHandler.setFormatter(consoleHandler_formatter)
     consoleHandler.setLevel(options.log_level)
-    logger.addHandler(consoleHandler)
 
     # Setup the log file:
     file_formatter = logging.Formatter(fmt='%(asctime)s - ' + FORMAT_BASE)
-    if not os.path.exists(DEFAULT_LOG_DIR):
-        os.mkdir(DEFAULT_LOG_DIR)
-    logfilename = os.path.join(DEFAULT_LOG_DIR, SCRIPT_NAME + '.log')
+    if not os.path.exists(options.log_dir):
+        os.mkdir(options.log_dir)
+    logfilename = os.path.join(options.log_dir, SCRIPT_NAME + '.log')
     fileHandler = logging.FileHandler(logfilename)
     fileHandler.setFormatter(file_formatter)
     fileHandler.setLevel(options.log_level)
-    logger.addHandler(fileHandler)
+
+    # Both handlers write from a background thread:
+    start_async_logging(logger, [consoleHandler, fileHandler])
 
     logger.verbose('Logger initialized, logLevel: %s' % options.log_level)
 
+def run_cycle(options, backend, high_water_mark, resume=False):
+    """
+    Export (or, if resume, reread the csvfile), then report or sync the players.
+    With --apply_plan, sync the plan's fixes instead; there is no export.
+    With --sync the HADR role is checked concurrently with the export, before any update.
+    Returns False if players were rejected, raises exception on any other failure.
+    """
+    if options.apply_plan:
+        # Validated as a whole before the HADR check and the first batch.
+        players = planned_players(options.apply_plan, options.plan_max_age)
+
+    preflight = None
+    if options.sync:
+        preflight = Preflight(backend)
+        preflight.start()
+
+    if not options.apply_plan:
+        if resume:
+            # Continue the interrupted sync of the existing csvfile, no new export.
+            csv_lines = read_extract(options.csvfile)
+            if high_water_mark:
+                high_water_mark.load()
+                csv_lines = high_water_mark.observe_lines(csv_lines)
+        else:
+            csv_lines = run_export_sync_pd_services(options, backend, high_water_mark)
+
+        if (options.find):
+            with metrics.timed('report'):
+                no_db(options, csv_lines)
+            if high_water_mark and options.daemon:
+                logger.verbose('High-water mark: ' + str(high_water_mark.save()))
+            return True
+
+        players = classify_players(csv_lines)
+
+    preflight.wait()
+    logger.verbose('Preparing to sync player accounts ...')
+    checkpoint = Checkpoint(options.journal_file, options.rejects_file)
+    logger.verbose('Resuming after ' + str(checkpoint.start(resume)) + ' journaled players')
+    try:
+        with metrics.timed('sync'):
+            if options.merge:
+                merge_players(options, backend, checkpoint, players)
+            else:
+                sync_players(options, backend, checkpoint, players)
+    finally:
+        checkpoint.close()
+
+    if high_water_mark and checkpoint.rejected_count:
+        # The mark only advances to just before the oldest rejected player, so the next incremental
+        # run exports the rejected players again; a --resume of the csvfile retries them too.
+        high_water_mark.hold_below(checkpoint.rejected_last_updated)
+    if high_water_mark:
+        logger.verbose('High-water mark: ' + str(high_water_mark.save()))
+
+    if checkpoint.rejected_count:
+        logger.error(str(checkpoint.rejected_count) + ' players rejected, see ' + options.rejects_file)
+        return False
+    return True
+
+def init_metrics(options, backend=None):
+    global metrics
+    metrics = Metrics(METRICS_PREFIX)
+    metrics.labels['mode'] = (options.history and 'history' or options.nodb and 'nodb' or
+                              options.find and 'find' or options.apply_plan and 'apply_plan' or 'sync')
+    if backend:
+        metrics.labels['backend'] = backend.name
+
+def run_daemon(options, backend, high_water_mark):
+    """
+    Run a cycle every options.interval seconds until terminated. The connection stays open
+    between cycles, rejected players included; after a cycle failed by an error it is reopened
+    for the next one.
+    """
+    def terminate(signum, frame):
+        logger.info('Terminated by signal ' + str(signum))
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    logger.info('Daemon started, cycle every ' + str(options.interval) + ' seconds')
+
+    cycle = 0
+    connected = True
+    while True:
+        cycle += 1
+        started = time.time()
+        init_metrics(options, backend)
+        if sync_cache:
+            logger.verbose('Synced contracts cache: %d expired' % sync_cache.evict())
+        success = False
+        try:
+            if not connected:
+                with metrics.timed('connect'):
+                    backend.connect()
+                connected = True
+            success = run_cycle(options, backend, high_water_mark)
+        except Exception as error:
+            logger.error('Cycle ' + str(cycle) + ' failed: ' + str(error))
+            backend.close()
+            connected = False
+
+        finish_cycle_progress()
+        write_metrics(options, success)
+        time.sleep(max(options.interval - (time.time() - started), 0))
+
 def main():
     exit_value = 1
     options, args = parse_cli_args()
 
-    if (options.nodb and options.sync) or (not options.nodb and not options.find and not options.sync):
+    if options.apply_plan and not (options.nodb or options.find or options.daemon or options.incremental or
+                                   options.plan):
+        options.sync = True  # Sync the plan's fixes instead of an export's; --sync is implied.
+    elif options.apply_plan or (options.plan and not (options.nodb or options.find)) or \
+         (options.plan and (options.history or options.daemon)):
+        parser.print_help()
+        exit(exit_value)
+
+    if (options.nodb and options.sync) or (not options.nodb and not options.find and not options.sync) or \
+       (options.resume and not options.sync) or (options.history and not options.nodb) or \
+       (options.daemon and (options.nodb or options.resume)):
         parser.print_help()
         exit(exit_value)
 
@@ -336,13 +900,24 @@ def main():
         exit(exit_value)
 
     options.path = os.path.abspath(options.path)
+    for dest in ('plan', 'apply_plan'):
+        if getattr(options, dest):
+            setattr(options, dest, os.path.abspath(getattr(options, dest)))
+    init_log_dir_files(options)
     os.chdir(options.path)
     init_logger(options)
     logger.verbose('Starting application')
+    backend = None
+    init_metrics(options)
+    init_progress(options)
 
     try:
         if options.nodb:
-            no_db(options)
+            with metrics.timed('report'):
+                if options.history:
+                    no_db_history(options)
+                else:
+                    no_db(options, read_extract(options.csvfile))
             exit_value = 0
             exit(exit_value)
 
@@ -351,69 +926,63 @@ def main():
             msg = 'Export SQL file not found:' + options.export_sql
             raise Exception(msg)
 
+        options.export_sqlt = os.path.join(options.path, options.export_sqlt)
+        if options.prefilter and not os.path.exists(options.export_sqlt):
+            msg = 'Export SQLT file not found: ' + options.export_sqlt
+            raise Exception(msg)
+
         options.update_sqlt = os.path.join(options.path, options.update_sqlt)
         if not os.path.exists(options.update_sqlt):
             msg = 'SQLT file not found: ' + options.update_sqlt
             raise Exception(msg)
 
-        options.csvfile = os.path.join(options.path, options.csvfile)
-
-        if not options.find:
-            check_hadr(options)
-        (logfile_name, historylog_name) = init_db2_options(options)
-        run_export_sync_pd_services(options, logfile_name, historylog_name)
-
-        if (options.find):
-            no_db(options)
-            logger.verbose('Exiting.')
-            exit_value = 0
-            exit(exit_value)
-
-        # If we're here, unless we said --sync exit else do it!
-        if not options.sync:
-            exit_value = 0
-            exit(exit_value)
+        options.merge_sql = os.path.join(options.path, options.merge_sql)
+        if options.merge and not os.path.exists(options.merge_sql):
+            msg = 'Merge SQL file not found: ' + options.merge_sql
+            raise Exception(msg)
 
-        logger.verbose('Preparing to sync player accounts ...')
-        connect_session = Popen(['db2', ('connect to ' + options.dbname)], stdout=PIPE, stderr=PIPE)
-        if connect_session.wait():
-            stdoutStrings, stderrStrings = connect_session.communicate()
-            raise Exception(convert_popen_strs_to_str(stdoutStrings))
+        options.csvfile = os.path.join(options.path, options.csvfile)
 
-        logger.verbose('Connected to ' + options.dbname)
-        processed_count = 0
-        total_count = sum(1 for line in open(options.csvfile))
-        logger.verbose('Exported ' + str(total_count) + ' players')
+        if options.apply_plan and not os.path.exists(options.apply_plan):
+            msg = 'Plan file not found: ' + options.apply_plan
+            raise Exception(msg)
 
-        csv_file = open(options.csvfile)
-        for csv_line in csv_file:
-            if csv_line.find('CONTRACT_IDENTITY') >= 0:
-                continue  # Skip column-heading row.
+        (logfile_name, historylog_name) = init_db2_options(options)
+        backend = create_backend(options, logger, logfile_name, historylog_name)
+        metrics.labels['backend'] = backend.name
+        with metrics.timed('connect'):
+            backend.connect()
 
-            player = Player(csv_line)
-            fixed_player = fix_player(player)
-            action_str = 'skipped'
+        if options.daemon and not options.incremental:
+            logger.verbose('--daemon implies --incremental')
+            options.incremental = True
 
-            if fixed_player != player:
-                action_str = 'synced'
-                sql_stmt = create_sql_stmt(options, fixed_player)
+        high_water_mark = None
+        if options.incremental:
+            high_water_mark = HighWaterMark(options.state_file)
 
-                process_session = Popen(['db2', '-z', logfile_name, '-l', historylog_name], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                process_session.stdin.write(sql_stmt)
-                stdoutStrings, stderrStrings = process_session.communicate()
-                omsg = convert_popen_strs_to_str(stdoutStrings)
-                emsg = convert_popen_strs_to_str(stderrStrings)
-                if omsg.count('error'): raise Exception(omsg)
-                if emsg.count('error'): raise Exception(emsg)
+        if options.sync:
+            init_sync_cache(options)
 
-            processed_count += 1
-            report_player(processed_count, total_count, fixed_player, action_str)
+        if options.daemon:
+            run_daemon(options, backend, high_water_mark)
 
-        exit_value = 0
+        if run_cycle(options, backend, high_water_mark, options.resume):
+            exit_value = 0
+        if options.find:
+            logger.verbose('Exiting.')
     except Exception as error:
         errtype, value, traceback = sys.exc_info()
         msg = str(value)
         logger.error(msg)
+    finally:
+        if sync_cache:
+            sync_cache.close()
+        if backend:
+            backend.close()
+        finish_progress()
+        if not options.daemon:
+            write_metrics(options, exit_value == 0)
 
     sys.exit(exit_value)
 
@@ -0,0 +1,89 @@
+"""
+  Synced contracts cache: a local SQLite index of the state last applied to each contract, kept
+  between runs. A fix that would set a contract to the state it was set to within the TTL, with
+  no contact update since, is a fix that did not stick, e.g. reverted by another writer: it is
+  reported, and applied again. Expired entries are evicted when the cache is opened, and by
+  evict() after that.
+"""
+import sqlite3
+import time
+
+from hwm import TIMESTAMP_RE
+
+def timestamp_seconds(timestamp):
+    """
+    Return a DB2 or SQLite timestamp as seconds since the epoch, or None if it is not one.
+    The database is taken to be in the script's time zone.
+    """
+    if not timestamp or not TIMESTAMP_RE.match(timestamp):
+        return None
+    seconds = time.mktime(time.strptime(timestamp[:10] + ' ' + timestamp[11:19].replace('.', ':'),
+                                        '%Y-%m-%d %H:%M:%S'))
+    return seconds + float('0' + timestamp[19:])
+
+class SyncCache(object):
+    def __init__(self, filename, ttl_seconds):
+        self.filename = filename
+        self.ttl_seconds = ttl_seconds
+        self.connection = None
+        self.entries = {}
+
+    def open(self):
+        """
+        Evict the expired entries and load the rest. Returns (entries, evicted).
+        """
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute('create table if not exists synced (contract_id integer primary key, '
+                                'email_verified integer not null, service_status_id integer not null, '
+                                'synced_at real not null)')
+        evicted = self.evict()
+
+        for (contract_id, email_verified, service_status_id, synced_at) in self.connection.execute(
+                'select contract_id, email_verified, service_status_id, synced_at from synced'):
+            self.entries[contract_id] = (email_verified, service_status_id, synced_at)
+        return (len(self.entries), evicted)
+
+    def evict(self):
+        """
+        Delete the entries older than the TTL. Returns how many were evicted.
+        """
+        expired_at = time.time() - self.ttl_seconds
+        cursor = self.connection.execute('delete from synced where synced_at < ?', (expired_at,))
+        evicted = cursor.rowcount
+        self.connection.commit()
+
+        for (contract_id, entry) in list(self.entries.items()):
+            if entry[2] < expired_at:
+                del self.entries[contract_id]
+        return evicted
+
+    def relapsed(self, fixed_player):
+        """
+        True if fixed_player's state is the one applied to its contract within the TTL, and the
+        contact's exported last_updated is not newer than that sync: the fix did not stick.
+        A row without a last_updated is never reported.
+        """
+        entry = self.entries.get(int(fixed_player.contractId))
+        if entry is None or entry[2] < time.time() - self.ttl_seconds:
+            return False
+        if entry[:2] != (int(fixed_player.emailVerified), int(fixed_player.portalService)):
+            return False
+
+        last_updated = timestamp_seconds(fixed_player.last_updated)
+        return last_updated is not None and last_updated <= entry[2]
+
+    def record(self, fixed_players):
+        """
+        Remember the states just applied, committed at once.
+        """
+        now = time.time()
+        rows = [(int(p.contractId), int(p.emailVerified), int(p.portalService), now) for p in fixed_players]
+        self.connection.executemany('insert or replace into synced values (?, ?, ?, ?)', rows)
+        self.connection.commit()
+        for (contract_id, email_verified, service_status_id, synced_at) in rows:
+            self.entries[contract_id] = (email_verified, service_status_id, synced_at)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None